@@ -1,84 +1,200 @@
-import gradio as gr
 import asyncio
+import gradio as gr
+from datetime import datetime
 from dotenv import load_dotenv
-from research_manager import ResearchManager
+from research_manager import create_research_manager, report_chunks
+from report_archive import get_report_archive, PAGE_SIZE
+from report_export import get_report_exporter, FORMATS
+from job_queue import RESTART_BANNER
+from state import ReportReady
 
 # Load environment variables
 load_dotenv(override=True)
 
-# Initialize research manager
-research_manager = ResearchManager()
+# Set up in main(): export workers are spawned processes that re-import this
+# module, and must not build a research manager or the UI of their own
+research_manager = None
+archive = None
 
-async def run_research(query: str):
-    """Run research and stream results to Gradio."""
+async def run_research(query: str, fresh: bool = False):
+    """Run research and stream results to Gradio, along with the (query, report) shown once finished."""
     if not query.strip():
-        yield "Please enter a valid research query."
+        yield "Please enter a valid research query.", None
         return
     
-    yield "🚀 **Starting research workflow...**\n\n"
+    yield "🚀 **Starting research workflow...**\n\n", None
     
     try:
         current_report = ""
-        async for chunk in research_manager.run(query):
-            if "Final Research Report" in chunk or "##" in chunk or "- " in chunk:
+        shown = None
+        async for chunk in research_manager.run(query, reuse_archive=not fresh):
+            if isinstance(chunk, ReportReady):
+                shown = (chunk.query, chunk.report)
+            elif chunk == RESTART_BANNER:
+                # The job was redelivered to another worker: start the output over
+                current_report = chunk
+                shown = None
+            elif "Final Research Report" in chunk or "##" in chunk or "- " in chunk:
                 current_report += chunk
-            yield current_report
+            yield current_report, shown
             
     except Exception as e:
-        yield f"❌ **Error occurred:** {str(e)}\n\nPlease try again."
+        yield f"❌ **Error occurred:** {str(e)}\n\nPlease try again.", None
 
-def run_sync(query: str):
-    """Wrapper to run async function synchronously."""
-    async def run_async():
-        full_output = ""
-        async for chunk in run_research(query):
-            full_output = chunk
-        return full_output
+def show_archive_page(search_text: str, pages: list):
+    """Render one page of the report archive. `pages` holds the cursor of every page visited."""
+    if archive is None:
+        return "Report archive is disabled.", gr.update(choices=[], value=None), [None], None
+    if search_text.strip():
+        # Search results are ranked, not dated, so they page by offset
+        entries = archive.search(search_text, limit=PAGE_SIZE, offset=(len(pages) - 1) * PAGE_SIZE)
+    else:
+        entries = archive.list_reports(before=pages[-1], limit=PAGE_SIZE)
     
-    return asyncio.run(run_async())
+    lines, choices = [], []
+    for entry in entries:
+        created = datetime.fromtimestamp(entry.created_at).strftime("%Y-%m-%d %H:%M")
+        lines.append(f"- **{entry.query}** · {created} · {entry.source_count} sources — {entry.short_summary[:150]}")
+        choices.append((f"{created} · {entry.query[:80]}", entry.report_id))
+    next_cursor = entries[-1].created_at if len(entries) == PAGE_SIZE else None
+    listing = f"**Page {len(pages)}**\n\n" + ("\n".join(lines) if lines else "No archived reports.")
+    return listing, gr.update(choices=choices, value=None), pages, next_cursor
+
+def search_archive(search_text: str):
+    return show_archive_page(search_text, [None])
+
+def older_archive_page(search_text: str, pages: list, next_cursor):
+    if next_cursor is None:
+        return show_archive_page(search_text, pages)
+    return show_archive_page(search_text, pages + [next_cursor])
+
+def newer_archive_page(search_text: str, pages: list):
+    return show_archive_page(search_text, pages[:-1] or [None])
+
+def open_archived_report(report_id: str):
+    if archive is None or not report_id:
+        return "### Select a report to open..."
+    archived_query, report, _ = archive.load(report_id)
+    return "".join(report_chunks(report, archived_query))
+
+async def render_export(report, query: str, fmt: str):
+    """Render a report in the export pool and offer it for download."""
+    try:
+        path = await get_report_exporter().aexport(report, query, fmt)
+    except Exception as e:
+        raise gr.Error(f"Export failed: {e}")
+    # Gradio serves the file from disk, streaming it rather than loading it into memory
+    return gr.update(value=path, visible=True)
 
-# Create interface
-with gr.Blocks(title="Deep Research Assistant") as app:
-    gr.Markdown("# 🔬 Deep Research Assistant")
+async def export_report(shown, fmt: str):
+    """Export the report on the research tab, exactly as it was shown."""
+    if not shown:
+        raise gr.Error("There is no finished report to export yet.")
+    query, report = shown
+    return await render_export(report, query, fmt)
+
+async def export_archived_report(report_id: str, fmt: str):
+    if archive is None or not report_id:
+        raise gr.Error("Select a report to export.")
+    archived_query, report, _ = await asyncio.to_thread(archive.load, report_id)
+    return await render_export(report, archived_query, fmt)
+
+def build_app() -> gr.Blocks:
+    """Create the interface."""
+    with gr.Blocks(title="Deep Research Assistant") as app:
+        gr.Markdown("# 🔬 Deep Research Assistant")
     
-    with gr.Row():
-        with gr.Column(scale=3):
-            query_input = gr.Textbox(
-                label="Research Topic",
-                placeholder="Enter your research query...",
-                lines=3
-            )
+        with gr.Tab("Research"):
+            with gr.Row():
+                with gr.Column(scale=3):
+                    query_input = gr.Textbox(
+                        label="Research Topic",
+                        placeholder="Enter your research query...",
+                        lines=3
+                    )
+                    fresh_input = gr.Checkbox(label="Run fresh research even if a recent archived report matches")
+                
+                    with gr.Row():
+                        submit_btn = gr.Button("Start Research", variant="primary")
+                        clear_btn = gr.Button("Clear")
+                
+                    # (query, ReportData) of the finished report on screen, for exports
+                    shown_report = gr.State(None)
+                    export_format = gr.Radio(list(FORMATS), value="pdf", label="Export format")
+                    with gr.Row():
+                        export_btn = gr.Button("📦 Export")
+                        download_btn = gr.DownloadButton("⬇️ Download", visible=False)
             
+                with gr.Column(scale=7):
+                    output = gr.Markdown(
+                        label="Research Report",
+                        value="### Your research report will appear here..."
+                    )
+    
+        with gr.Tab("Archive") as archive_tab:
+            pages_state = gr.State([None])
+            next_cursor_state = gr.State(None)
             with gr.Row():
-                submit_btn = gr.Button("Start Research", variant="primary")
-                clear_btn = gr.Button("Clear")
-        
-        with gr.Column(scale=7):
-            output = gr.Markdown(
-                label="Research Report",
-                value="### Your research report will appear here..."
-            )
+                with gr.Column(scale=3):
+                    archive_search = gr.Textbox(label="Search archived reports", placeholder="Leave empty to browse newest first")
+                    archive_list = gr.Markdown()
+                    with gr.Row():
+                        newer_btn = gr.Button("⬅️ Newer")
+                        older_btn = gr.Button("Older ➡️")
+                    report_select = gr.Dropdown(label="Report", choices=[])
+                    archive_export_format = gr.Radio(list(FORMATS), value="pdf", label="Export format")
+                    with gr.Row():
+                        archive_export_btn = gr.Button("📦 Export")
+                        archive_download_btn = gr.DownloadButton("⬇️ Download", visible=False)
+            
+                with gr.Column(scale=7):
+                    archived_output = gr.Markdown(value="### Select a report to open...")
     
-    # Event handlers
-    submit_btn.click(
-        fn=run_sync,
-        inputs=query_input,
-        outputs=output,
-        show_progress="full"
-    )
+        # Event handlers
+        # Handlers are async generators so Gradio can cancel them (Clear, client disconnect),
+        # which cancels every model and search call still in flight.
+        submit_event = submit_btn.click(
+            fn=run_research,
+            inputs=[query_input, fresh_input],
+            outputs=[output, shown_report],
+            show_progress="full"
+        )
     
-    clear_btn.click(
-        fn=lambda: ("", "### Enter a new research query..."),
-        inputs=[],
-        outputs=[query_input, output]
-    )
+        enter_event = query_input.submit(
+            fn=run_research,
+            inputs=[query_input, fresh_input],
+            outputs=[output, shown_report],
+            show_progress="full"
+        )
     
-    query_input.submit(
-        fn=run_sync,
-        inputs=query_input,
-        outputs=output,
-        show_progress="full"
-    )
+        # A new run makes the previous download stale
+        submit_btn.click(fn=lambda: gr.update(visible=False), outputs=download_btn)
+        query_input.submit(fn=lambda: gr.update(visible=False), outputs=download_btn)
+    
+        clear_btn.click(
+            fn=lambda: ("", "### Enter a new research query...", None, gr.update(visible=False)),
+            inputs=[],
+            outputs=[query_input, output, shown_report, download_btn],
+            cancels=[submit_event, enter_event]
+        )
+    
+        archive_outputs = [archive_list, report_select, pages_state, next_cursor_state]
+        archive_tab.select(fn=search_archive, inputs=archive_search, outputs=archive_outputs)
+        archive_search.submit(fn=search_archive, inputs=archive_search, outputs=archive_outputs)
+        older_btn.click(fn=older_archive_page, inputs=[archive_search, pages_state, next_cursor_state], outputs=archive_outputs)
+        newer_btn.click(fn=newer_archive_page, inputs=[archive_search, pages_state], outputs=archive_outputs)
+        report_select.change(fn=open_archived_report, inputs=report_select, outputs=archived_output)
+        report_select.change(fn=lambda: gr.update(visible=False), outputs=archive_download_btn)
+    
+        export_btn.click(fn=export_report, inputs=[shown_report, export_format], outputs=download_btn)
+        archive_export_btn.click(fn=export_archived_report, inputs=[report_select, archive_export_format], outputs=archive_download_btn)
+    return app
+
+def main() -> None:
+    global research_manager, archive
+    research_manager = create_research_manager()
+    archive = get_report_archive()
+    build_app().launch(server_name="0.0.0.0", server_port=7860, share=False, inbrowser=True)
 
 if __name__ == "__main__":
-    app.launch(server_name="0.0.0.0", server_port=7860, share=False, inbrowser=True)
\ No newline at end of file
+    main()
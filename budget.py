@@ -0,0 +1,314 @@
+"""
+Token budgets.
+
+Each job may spend JOB_TOKEN_BUDGET tokens and each tenant TENANT_DAILY_TOKEN_BUDGET
+per UTC day. Budgets count model_large-equivalent tokens: model_mini tokens are
+charged at MODEL_COST_WEIGHTS["mini"], so switching models is a real saving.
+
+Every model call goes through `charged`, which estimates the call (prompt at
+about CHARS_PER_TOKEN characters per token, plus the output allowance) and
+holds that much budget before sending it, then settles the hold with the
+usage the provider reports. Holds keep parallel searches from overspending
+together. A call that does not fit raises BudgetExceeded, and the nodes
+degrade instead of failing: the planner plans fewer searches, searches skip
+extra tool calls and summaries, and the writer moves to model_mini and then
+to a shorter report.
+
+Checks use a cached copy of each tenant's spend, refreshed off the event loop
+every TENANT_SPEND_REFRESH_SECONDS. If the shared ledger cannot be reached,
+spend is tracked in this process until it comes back.
+"""
+import os
+import time
+import asyncio
+import logging
+import threading
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+from deadline import bounded
+
+logger = logging.getLogger(__name__)
+
+JOB_TOKEN_BUDGET = float(os.getenv("JOB_TOKEN_BUDGET", "40000"))
+TENANT_DAILY_TOKEN_BUDGET = float(os.getenv("TENANT_DAILY_TOKEN_BUDGET", "1000000"))
+DEFAULT_TENANT = os.getenv("RESEARCH_TENANT", "default")
+# Tenant spend is shared through Redis when set, so limits hold across a worker fleet
+BUDGET_REDIS_URL = os.getenv("BUDGET_REDIS_URL", "")
+# How stale the cached tenant spend used for budget checks may get
+TENANT_SPEND_REFRESH_SECONDS = float(os.getenv("TENANT_SPEND_REFRESH_SECONDS", "5"))
+# Longest a model call or job start waits on the shared ledger before going on without it
+LEDGER_TIMEOUT = float(os.getenv("BUDGET_LEDGER_TIMEOUT", "2"))
+
+CHARS_PER_TOKEN = 4
+# Cost of a model's tokens relative to model_large (from list prices)
+MODEL_COST_WEIGHTS = {"large": 1.0, "mini": 0.25}
+# Rough cost of one planned search (tool call plus summary, on model_mini)
+SEARCH_TOKEN_ESTIMATE = 1500.0
+# Budget kept back for the writer and notifier while planning and searching
+WRITER_TOKEN_RESERVE = 6000.0
+# Budget kept back for the notifier while writing
+NOTIFY_TOKEN_RESERVE = 300.0
+DEFAULT_OUTPUT_TOKENS = 1000
+
+class BudgetExceeded(RuntimeError):
+    """The job (or its tenant) cannot afford this model call."""
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + 1
+
+def estimate_messages(messages: List[Any]) -> int:
+    # A few tokens of per-message framing on top of the content
+    return sum(estimate_tokens(str(getattr(m, "content", m))) + 4 for m in messages)
+
+def trim_to_tokens(text: str, tokens: float) -> str:
+    """Cut `text` to roughly `tokens` tokens, marking the cut."""
+    limit = max(int(tokens), 0) * CHARS_PER_TOKEN
+    if len(text) <= limit:
+        return text
+    return text[:limit] + "\n[... truncated to fit the token budget]"
+
+def reported_tokens(response: Any) -> Optional[int]:
+    """Total tokens the provider reported for a response, if it did."""
+    if isinstance(response, dict):
+        # with_structured_output(include_raw=True)
+        response = response.get("raw")
+    usage = getattr(response, "usage_metadata", None)
+    if usage:
+        return int(usage.get("total_tokens", 0)) or None
+    return None
+
+# ----------------------------------------------------------------------
+# Tenant ledgers
+# ----------------------------------------------------------------------
+def _day() -> str:
+    return time.strftime("%Y-%m-%d", time.gmtime())
+
+class TenantLedger:
+    """Per-tenant spend for the current UTC day, kept in this process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._spent: Dict[tuple, float] = {}
+
+    def spent(self, tenant: str) -> float:
+        with self._lock:
+            return self._spent.get((tenant, _day()), 0.0)
+
+    def record(self, tenant: str, cost: float) -> None:
+        day = _day()
+        with self._lock:
+            # Only today's totals matter; drop earlier days as they roll over
+            self._spent = {k: v for k, v in self._spent.items() if k[1] == day}
+            self._spent[(tenant, day)] = self._spent.get((tenant, day), 0.0) + cost
+
+class RedisTenantLedger(TenantLedger):
+    """Per-tenant daily spend shared by every process using the same Redis."""
+
+    def __init__(self, url: str):
+        import redis
+
+        self.redis = redis.Redis.from_url(
+            url, decode_responses=True, socket_timeout=LEDGER_TIMEOUT, socket_connect_timeout=LEDGER_TIMEOUT
+        )
+
+    def _key(self, tenant: str) -> str:
+        return f"research:budget:{tenant}:{_day()}"
+
+    def spent(self, tenant: str) -> float:
+        return float(self.redis.get(self._key(tenant)) or 0.0)
+
+    def record(self, tenant: str, cost: float) -> None:
+        key = self._key(tenant)
+        pipe = self.redis.pipeline()
+        pipe.incrbyfloat(key, cost)
+        pipe.expire(key, 2 * 86400)
+        pipe.execute()
+
+# ----------------------------------------------------------------------
+# Job budgets
+# ----------------------------------------------------------------------
+@dataclass(slots=True)
+class JobBudget:
+    tenant: str
+    limit: float
+    spent: float = 0.0
+    held: float = 0.0
+    tokens: int = 0
+    calls: int = 0
+
+class BudgetLedger:
+    """Tracks spend and outstanding holds for every running job in this process.
+
+    Only `refresh_tenant` and `record` touch the tenant ledger; they block, so
+    callers on the event loop use `arefresh_tenant` and `arecord`, which give up
+    after LEDGER_TIMEOUT. Everything else is in memory.
+    """
+
+    def __init__(self, tenants: TenantLedger):
+        self.tenants = tenants
+        # Spend that could not be written to `tenants`, still counted here
+        self.unsynced = TenantLedger()
+        self._lock = threading.Lock()
+        self._jobs: Dict[str, JobBudget] = {}
+        # tenant -> (spent today, time.monotonic() of the last refresh)
+        self._tenant_spent: Dict[str, tuple] = {}
+
+    def open_job(self, job_id: str, tenant: str = DEFAULT_TENANT, limit: Optional[float] = None) -> None:
+        with self._lock:
+            self._jobs[job_id] = JobBudget(tenant=tenant, limit=limit if limit is not None else JOB_TOKEN_BUDGET)
+
+    def close_job(self, job_id: str) -> Optional[JobBudget]:
+        with self._lock:
+            return self._jobs.pop(job_id, None)
+
+    def refresh_tenant(self, tenant: str) -> None:
+        """Re-read the tenant's spend from the tenant ledger. Blocking."""
+        try:
+            spent = self.tenants.spent(tenant)
+        except Exception as e:
+            logger.error(f"Could not read spend of tenant {tenant}, using the last known value: {e}")
+            self._keep_last_known(tenant)
+            return
+        spent += self.unsynced.spent(tenant)
+        with self._lock:
+            self._tenant_spent[tenant] = (spent, time.monotonic())
+
+    def _keep_last_known(self, tenant: str) -> None:
+        # Counts as a refresh, so the ledger is not retried on every call until the next one is due
+        with self._lock:
+            cached, _ = self._tenant_spent.get(tenant, (self.unsynced.spent(tenant), 0.0))
+            self._tenant_spent[tenant] = (cached, time.monotonic())
+
+    async def arefresh_tenant(self, tenant: str) -> None:
+        """refresh_tenant off the event loop, keeping the cached spend if the ledger is slow."""
+        try:
+            await asyncio.wait_for(asyncio.to_thread(self.refresh_tenant, tenant), LEDGER_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.error(f"Tenant ledger did not answer in {LEDGER_TIMEOUT:.0f}s, using the last known spend of {tenant}")
+            self._keep_last_known(tenant)
+
+    async def arecord(self, tenant: str, cost: float) -> None:
+        """record off the event loop. The cached spend is updated first, so a slow ledger only delays the write."""
+        try:
+            await asyncio.wait_for(asyncio.to_thread(self.record, tenant, cost), LEDGER_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.error(f"Tenant ledger did not answer in {LEDGER_TIMEOUT:.0f}s while recording spend of {tenant}")
+
+    def stale_tenant(self, job_id: str) -> Optional[str]:
+        """The job's tenant if its cached spend is due a refresh, else None."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            cached = self._tenant_spent.get(job.tenant)
+            if cached is not None and time.monotonic() - cached[1] < TENANT_SPEND_REFRESH_SECONDS:
+                return None
+            if cached is not None:
+                # Claim the refresh so parallel calls keep using the cached value meanwhile
+                self._tenant_spent[job.tenant] = (cached[0], time.monotonic())
+            return job.tenant
+
+    def record(self, tenant: str, cost: float) -> None:
+        """Add `cost` to the tenant's spend for today. Blocking."""
+        with self._lock:
+            cached, refreshed_at = self._tenant_spent.get(tenant, (0.0, 0.0))
+            self._tenant_spent[tenant] = (cached + cost, refreshed_at)
+        try:
+            self.tenants.record(tenant, cost)
+        except Exception as e:
+            logger.error(f"Could not record spend of tenant {tenant}, tracking it in this process: {e}")
+            self.unsynced.record(tenant, cost)
+
+    def tenant_left(self, tenant: str) -> float:
+        """Tenant budget left today, from the cached spend (see refresh_tenant)."""
+        with self._lock:
+            return self._tenant_left(tenant)
+
+    def _tenant_left(self, tenant: str) -> float:
+        return TENANT_DAILY_TOKEN_BUDGET - self._tenant_spent.get(tenant, (0.0, 0.0))[0]
+
+    def _left(self, job: JobBudget) -> float:
+        # Holds of this tenant's other jobs in this process count against it too
+        tenant_held = sum(j.held for j in self._jobs.values() if j.tenant == job.tenant)
+        return min(job.limit - job.spent - job.held, self._tenant_left(job.tenant) - tenant_held)
+
+    def left(self, job_id: str) -> Optional[float]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return self._left(job) if job is not None else None
+
+    def hold(self, job_id: str, cost: float, keep: float = 0.0) -> bool:
+        """Reserve `cost` for a call, leaving at least `keep` unspent. False if unaffordable."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return True
+            if self._left(job) - keep < cost:
+                return False
+            job.held += cost
+            return True
+
+    def settle(self, job_id: str, held: float, cost: Optional[float], tokens: int = 0) -> Optional[str]:
+        """Release a hold, charging `cost` (None when the call never ran) to the job.
+
+        Returns the tenant to `record` the cost against, if any.
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            job.held = max(job.held - held, 0.0)
+            if cost is None:
+                return None
+            job.spent += cost
+            job.tokens += tokens
+            job.calls += 1
+            return job.tenant
+
+_ledger: Optional[BudgetLedger] = None
+_ledger_lock = threading.Lock()
+
+def get_budget_ledger() -> BudgetLedger:
+    global _ledger
+    with _ledger_lock:
+        if _ledger is None:
+            tenants = TenantLedger()
+            if BUDGET_REDIS_URL:
+                try:
+                    tenants = RedisTenantLedger(BUDGET_REDIS_URL)
+                except Exception as e:
+                    logger.error(f"Shared budget ledger unavailable, tracking tenants per process: {e}")
+            _ledger = BudgetLedger(tenants)
+        return _ledger
+
+def budget_left(state: dict, keep: float = 0.0) -> Optional[float]:
+    """Budget the job can still spend minus `keep`, or None if the job has no budget."""
+    left = get_budget_ledger().left(state.get("job_id", ""))
+    return None if left is None else left - keep
+
+async def charged(
+    model, messages: List[Any], state: dict, tier: str = "mini",
+    output_tokens: int = DEFAULT_OUTPUT_TOKENS, keep: float = 0.0, reserve: float = 0.0
+):
+    """Invoke `model` within the job's token budget (leaving `keep`) and deadline (leaving `reserve` seconds)."""
+    ledger = get_budget_ledger()
+    job_id = state.get("job_id", "")
+    weight = MODEL_COST_WEIGHTS[tier]
+    estimate = (estimate_messages(messages) + output_tokens) * weight
+    stale = ledger.stale_tenant(job_id)
+    if stale is not None:
+        await ledger.arefresh_tenant(stale)
+    if not ledger.hold(job_id, estimate, keep):
+        raise BudgetExceeded(f"Token budget too low for a {estimate:.0f}-token call")
+    try:
+        response = await bounded(model.ainvoke(messages), state, reserve)
+    except BaseException:
+        ledger.settle(job_id, estimate, None)
+        raise
+    tokens = reported_tokens(response)
+    cost = tokens * weight if tokens else estimate
+    tenant = ledger.settle(job_id, estimate, cost, tokens or 0)
+    if tenant is not None:
+        await ledger.arecord(tenant, cost)
+    return response
@@ -1,7 +1,15 @@
 import streamlit as st
+import os
 import asyncio
+from datetime import datetime
 from dotenv import load_dotenv
-from research_manager import ResearchManager
+from streamlit.runtime import get_instance as get_runtime
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+from research_manager import create_research_manager, report_chunks
+from report_archive import get_report_archive, PAGE_SIZE
+from report_export import get_report_exporter, report_hash, FORMATS
+from job_queue import RESTART_BANNER
+from state import ReportReady
 
 # Load environment variables
 load_dotenv(override=True)
@@ -32,13 +40,24 @@ st.markdown("""
     </style>
 """, unsafe_allow_html=True)
 
+@st.cache_resource
+def get_research_manager():
+    """One manager per process, shared by every session (in memory:// mode it owns a worker thread)."""
+    return create_research_manager()
+
 # Initialize session state
-if 'research_manager' not in st.session_state:
-    st.session_state.research_manager = ResearchManager()
 if 'report' not in st.session_state:
     st.session_state.report = ""
 if 'running' not in st.session_state:
     st.session_state.running = False
+if 'shown_report' not in st.session_state:
+    # (query, ReportData) of the report on screen, used for exports
+    st.session_state.shown_report = None
+if 'archive_cursors' not in st.session_state:
+    # created_at cursor of every archive page visited so far; the last one is the current page
+    st.session_state.archive_cursors = [None]
+
+archive = get_report_archive()
 
 # Header
 st.title("🔬 Deep Research Assistant")
@@ -61,6 +80,10 @@ with col2:
         disabled=st.session_state.running or not query.strip(),
         use_container_width=True
     )
+fresh_research = st.checkbox(
+    "Run fresh research even if a recent archived report matches",
+    disabled=st.session_state.running
+)
 
 st.divider()
 
@@ -68,6 +91,7 @@ st.divider()
 if start_btn and query.strip():
     st.session_state.running = True
     st.session_state.report = ""
+    st.session_state.shown_report = None
     
     # Status container
     status_container = st.container()
@@ -88,9 +112,20 @@ if start_btn and query.strip():
         total_nodes = 4  # planner, researcher, writer, notifier
         
         try:
-            async for chunk in st.session_state.research_manager.run(query):
+            async for chunk in get_research_manager().run(query, reuse_archive=not fresh_research):
+                if isinstance(chunk, ReportReady):
+                    st.session_state.shown_report = (chunk.query, chunk.report)
+                
+                elif chunk == RESTART_BANNER:
+                    # The job was redelivered to another worker: start the output over
+                    status_updates, node_count = [chunk.strip()], 0
+                    st.session_state.report = ""
+                    st.session_state.shown_report = None
+                    progress_bar.progress(0)
+                    status_placeholder.markdown(chunk)
+                
                 # Track status updates
-                if "**" in chunk and "COMPLETE" in chunk:
+                elif "**" in chunk and "COMPLETE" in chunk:
                     status_updates.append(chunk.strip())
                     node_count += 1
                     progress = min(node_count / total_nodes, 1.0)
@@ -120,12 +155,48 @@ if start_btn and query.strip():
         finally:
             st.session_state.running = False
     
+    async def run_until_disconnect():
+        """Run the research, cancelling it if the browser session goes away."""
+        ctx = get_script_run_ctx()
+        task = asyncio.create_task(run_research())
+        while not task.done():
+            await asyncio.wait({task}, timeout=1.0)
+            if not task.done() and ctx and not get_runtime().is_active_session(ctx.session_id):
+                print("🛑 Browser session closed, cancelling research")
+                task.cancel()
+    
     # Run async function
-    asyncio.run(run_research())
+    asyncio.run(run_until_disconnect())
 
 elif st.session_state.report:
     # Display previous report
     st.markdown(st.session_state.report)
+    
+    if st.session_state.shown_report:
+        shown_query, shown = st.session_state.shown_report
+        shown_hash = report_hash(shown, shown_query)
+        st.divider()
+        format_col, export_col, download_col = st.columns([2, 1, 1])
+        export_format = format_col.radio("Export format", list(FORMATS), horizontal=True)
+        if export_col.button("📦 Export", use_container_width=True):
+            with st.spinner("Rendering export..."):
+                try:
+                    # Rendering happens in the export pool; this only waits for the file
+                    path = get_report_exporter().export(shown, shown_query, export_format).result()
+                    st.session_state.export = (shown_hash, path)
+                except Exception as e:
+                    st.error(f"Export failed: {e}")
+        export_hash, export_path = st.session_state.get("export", (None, ""))
+        if (export_hash == shown_hash and export_path.endswith(f".{FORMATS[export_format][0]}")
+                and os.path.exists(export_path)):
+            with open(export_path, "rb") as f:
+                download_col.download_button(
+                    "⬇️ Download",
+                    data=f,
+                    file_name=os.path.basename(export_path),
+                    mime=FORMATS[export_format][1],
+                    use_container_width=True
+                )
 
 else:
     # Welcome message
@@ -152,6 +223,41 @@ else:
         - "Current trends in sustainable energy"
         """)
 
+# Report archive
+if archive is not None and not st.session_state.running:
+    with st.expander("🗄️ Report archive"):
+        # Listing pages by created_at cursor and search by offset, so a new search starts over
+        search_text = st.text_input(
+            "Search archived reports", key="archive_search",
+            on_change=lambda: st.session_state.update(archive_cursors=[None])
+        )
+        if search_text.strip():
+            # Search results are ranked, not dated, so they page by offset
+            page_number = len(st.session_state.archive_cursors) - 1
+            entries = archive.search(search_text, limit=PAGE_SIZE, offset=page_number * PAGE_SIZE)
+        else:
+            entries = archive.list_reports(before=st.session_state.archive_cursors[-1], limit=PAGE_SIZE)
+        
+        for entry in entries:
+            created = datetime.fromtimestamp(entry.created_at).strftime("%Y-%m-%d %H:%M")
+            entry_col, open_col = st.columns([5, 1])
+            entry_col.markdown(f"**{entry.query}** · {created} · {entry.source_count} sources  \n{entry.short_summary[:200]}")
+            if open_col.button("Open", key=f"open_{entry.report_id}"):
+                archived_query, report, _ = archive.load(entry.report_id)
+                st.session_state.report = "".join(report_chunks(report, archived_query))
+                st.session_state.shown_report = (archived_query, report)
+                st.rerun()
+        if not entries:
+            st.caption("No archived reports.")
+        
+        prev_col, next_col = st.columns(2)
+        if prev_col.button("⬅️ Newer", disabled=len(st.session_state.archive_cursors) == 1):
+            st.session_state.archive_cursors.pop()
+            st.rerun()
+        if next_col.button("Older ➡️", disabled=len(entries) < PAGE_SIZE):
+            st.session_state.archive_cursors.append(entries[-1].created_at)
+            st.rerun()
+
 # Footer
 st.divider()
 st.caption("Built with LangGraph, Groq, and Streamlit")
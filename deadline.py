@@ -0,0 +1,48 @@
+"""
+Job deadlines.
+
+Each research job carries an absolute `deadline` (epoch seconds) in its state.
+Every model and search call is awaited through `bounded`, so no call outlives
+the job. Searches stop early enough to leave the writer WRITER_RESERVE_SECONDS,
+and a writer that is short on time produces a shorter report instead of none.
+"""
+import os
+import time
+import asyncio
+from typing import Awaitable, Optional, TypeVar
+
+T = TypeVar("T")
+
+JOB_DEADLINE_SECONDS = float(os.getenv("JOB_DEADLINE_SECONDS", "300"))
+# Time kept back for writing the report when earlier steps run long
+WRITER_RESERVE_SECONDS = 60.0
+# Below this much time left the writer asks for a short report
+SHORT_REPORT_SECONDS = 90.0
+
+class DeadlineExceeded(TimeoutError):
+    """The job ran out of time before this step could finish."""
+
+def new_deadline(seconds: Optional[float] = None) -> float:
+    return time.time() + (seconds if seconds is not None else JOB_DEADLINE_SECONDS)
+
+def time_left(state: dict, reserve: float = 0.0) -> Optional[float]:
+    """Seconds until the job deadline minus `reserve`, or None if the job has no deadline."""
+    deadline = state.get("deadline")
+    if deadline is None:
+        return None
+    return deadline - reserve - time.time()
+
+async def bounded(awaitable: Awaitable[T], state: dict, reserve: float = 0.0) -> T:
+    """Await a call, giving up with DeadlineExceeded when the job's time (minus `reserve`) runs out."""
+    remaining = time_left(state, reserve)
+    if remaining is None:
+        return await awaitable
+    if remaining <= 0:
+        # Close the coroutine so it does not warn about never being awaited
+        if asyncio.iscoroutine(awaitable):
+            awaitable.close()
+        raise DeadlineExceeded("Job deadline reached")
+    try:
+        return await asyncio.wait_for(awaitable, timeout=remaining)
+    except asyncio.TimeoutError:
+        raise DeadlineExceeded("Job deadline reached") from None
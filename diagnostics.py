@@ -0,0 +1,290 @@
+"""
+Event-loop diagnostics: loop lag, blocking-call detection and per-job profiling.
+
+Enable with RESEARCH_DIAGNOSTICS=1. For every event loop that runs research
+jobs, a LoopMonitor then:
+
+- measures scheduling lag with a ticker task and keeps lag statistics;
+- runs a watchdog thread that, when the loop has not ticked for
+  STALL_THRESHOLD_MS, logs the stack of whatever is blocking it, tagged with
+  the job that was running;
+- optionally samples the loop thread's stack while a chosen job is running
+  and writes the samples in collapsed-stack format (one "a;b;c count" line
+  per stack), which flamegraph.pl, inferno and speedscope read directly.
+
+Jobs are attributed through the JOB_ID context variable: tasks created while it
+is set are wrapped so the monitor knows which job the loop is executing.
+
+A job is profiled when started with `profile=True`, or while it runs: research
+workers install a SIGUSR1 handler, so `kill -USR1 <worker pid>` profiles every
+job that process is running from then on.
+"""
+import os
+import sys
+import time
+import signal
+import asyncio
+import logging
+import threading
+import traceback
+import contextvars
+import collections.abc
+import weakref
+from collections import Counter
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+DIAGNOSTICS_ENABLED = os.getenv("RESEARCH_DIAGNOSTICS", "0") == "1"
+STALL_THRESHOLD_MS = float(os.getenv("STALL_THRESHOLD_MS", "100"))
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+MAX_STALLS_KEPT = 100
+
+JOB_ID: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("research_job_id", default=None)
+
+@dataclass(slots=True)
+class Stall:
+    """One period during which the event loop was blocked."""
+    started_at: float
+    duration_ms: float
+    job_id: Optional[str]
+    stack: str
+
+class _JobTaggedCoroutine(collections.abc.Coroutine):
+    """Wraps a task's coroutine so the monitor sees which job is on the loop during each step."""
+    __slots__ = ("_coro", "_job_id", "_monitor")
+
+    def __init__(self, coro, job_id: str, monitor: "LoopMonitor"):
+        self._coro = coro
+        self._job_id = job_id
+        self._monitor = monitor
+
+    def send(self, value):
+        previous, self._monitor.current_job = self._monitor.current_job, self._job_id
+        try:
+            return self._coro.send(value)
+        finally:
+            self._monitor.current_job = previous
+
+    def throw(self, *args):
+        previous, self._monitor.current_job = self._monitor.current_job, self._job_id
+        try:
+            return self._coro.throw(*args)
+        finally:
+            self._monitor.current_job = previous
+
+    def close(self):
+        return self._coro.close()
+
+    def __await__(self):
+        return self
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return self.send(None)
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_qualname} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+
+def _collapsed_stack(frame) -> str:
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    return ";".join(reversed(labels))
+
+class LoopMonitor:
+    """Lag meter, stall watchdog and job profiler for one event loop."""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, threshold_ms: float = STALL_THRESHOLD_MS):
+        self.loop = loop
+        self.threshold = threshold_ms / 1000.0
+        self.tick_interval = self.threshold / 4
+        self.loop_thread_id = threading.get_ident()
+        self.current_job: Optional[str] = None
+        self.stalls: List[Stall] = []
+        self.lag_max = 0.0
+        self.lag_total = 0.0
+        self.lag_count = 0
+        self._last_tick = time.monotonic()
+        self._stall_open = False
+        self._profiles: Dict[str, Counter] = {}
+        self._stopped = threading.Event()
+        # Set while any job is being profiled; the sampler sleeps on it otherwise
+        self._profiling = threading.Event()
+
+    def start(self) -> None:
+        self._install_task_factory()
+        self.loop.create_task(self._ticker())
+        threading.Thread(target=self._watchdog, daemon=True, name="loop-watchdog").start()
+        threading.Thread(target=self._sampler, daemon=True, name="loop-profiler").start()
+        print(f"🩺 Loop diagnostics on (stall threshold {self.threshold * 1000:.0f} ms)")
+
+    def stop(self) -> None:
+        self._stopped.set()
+
+    def _install_task_factory(self) -> None:
+        previous = self.loop.get_task_factory()
+
+        def factory(loop, coro, **kwargs):
+            context = kwargs.get("context") or contextvars.copy_context()
+            job_id = context.get(JOB_ID)
+            if job_id is not None:
+                coro = _JobTaggedCoroutine(coro, job_id, self)
+            if previous is not None:
+                return previous(loop, coro, **kwargs)
+            return asyncio.Task(coro, loop=loop, **kwargs)
+
+        self.loop.set_task_factory(factory)
+
+    async def _ticker(self) -> None:
+        while not self._stopped.is_set():
+            before = time.monotonic()
+            await asyncio.sleep(self.tick_interval)
+            now = time.monotonic()
+            lag = now - before - self.tick_interval
+            self.lag_max = max(self.lag_max, lag)
+            self.lag_total += lag
+            self.lag_count += 1
+            self._last_tick = now
+            if self._stall_open:
+                self._stall_open = False
+                logger.warning(f"Event loop resumed after {lag * 1000:.0f} ms")
+
+    def _watchdog(self) -> None:
+        while not self._stopped.wait(self.threshold / 2):
+            if self.loop.is_closed():
+                return
+            blocked = time.monotonic() - self._last_tick - self.tick_interval
+            if blocked < self.threshold or self._stall_open:
+                continue
+            frame = sys._current_frames().get(self.loop_thread_id)
+            stack = "".join(traceback.format_stack(frame)) if frame is not None else "<no stack>"
+            stall = Stall(started_at=time.time() - blocked, duration_ms=blocked * 1000,
+                          job_id=self.current_job, stack=stack)
+            self._stall_open = True
+            self.stalls = (self.stalls + [stall])[-MAX_STALLS_KEPT:]
+            logger.warning(
+                f"Event loop blocked for {stall.duration_ms:.0f}+ ms (job {stall.job_id or '-'}). "
+                f"Blocking call:\n{stack}"
+            )
+
+    def _sampler(self) -> None:
+        interval = PROFILE_INTERVAL_MS / 1000.0
+        while not self._stopped.is_set():
+            if not self._profiling.wait(1.0):
+                if self.loop.is_closed():
+                    return
+                continue
+            time.sleep(interval)
+            if self.loop.is_closed():
+                return
+            samples = self._profiles.get(self.current_job) if self.current_job else None
+            if samples is None:
+                continue
+            frame = sys._current_frames().get(self.loop_thread_id)
+            if frame is not None:
+                samples[_collapsed_stack(frame)] += 1
+
+    # ------------------------------------------------------------------
+    # Per-job profiling
+    # ------------------------------------------------------------------
+    def profile(self, job_id: str) -> None:
+        """Start sampling the loop whenever `job_id` is running on it."""
+        self._profiles.setdefault(job_id, Counter())
+        self._profiling.set()
+
+    def finish_profile(self, job_id: str) -> Optional[str]:
+        """Stop profiling a job and write its collapsed stacks. Returns the file path."""
+        samples = self._profiles.pop(job_id, None)
+        if not self._profiles:
+            self._profiling.clear()
+        if not samples:
+            return None
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        path = os.path.join(PROFILE_DIR, f"{job_id}.folded")
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in samples.most_common():
+                f.write(f"{stack} {count}\n")
+        print(f"🔥 Profile for job {job_id}: {sum(samples.values())} samples -> {path}")
+        return path
+
+    def stats(self) -> dict:
+        return {
+            "lag_max_ms": round(self.lag_max * 1000, 1),
+            "lag_avg_ms": round(self.lag_total / self.lag_count * 1000, 2) if self.lag_count else 0.0,
+            "stalls": len(self.stalls),
+        }
+
+_monitors: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, LoopMonitor]" = weakref.WeakKeyDictionary()
+_profile_requests: set = set()
+_running_jobs: set = set()
+
+def get_monitor() -> Optional[LoopMonitor]:
+    """Monitor for the running loop, started on first use. None when diagnostics are off."""
+    if not DIAGNOSTICS_ENABLED:
+        return None
+    loop = asyncio.get_running_loop()
+    monitor = _monitors.get(loop)
+    if monitor is None:
+        monitor = LoopMonitor(loop)
+        monitor.start()
+        _monitors[loop] = monitor
+    return monitor
+
+def request_profile(job_id: str) -> None:
+    """Profile a job by ID from now on, whether it is already running or starts later in this process."""
+    _profile_requests.add(job_id)
+    for monitor in list(_monitors.values()):
+        monitor.profile(job_id)
+
+def profile_running_jobs() -> None:
+    """Profile every job running in this process, until each finishes."""
+    if not _running_jobs:
+        print("🔥 Profile requested, but no job is running")
+    for job_id in list(_running_jobs):
+        print(f"🔥 Profiling job {job_id} until it finishes")
+        request_profile(job_id)
+
+def install_profile_signal() -> bool:
+    """Run profile_running_jobs on SIGUSR1. False when diagnostics are off or the loop cannot take signals."""
+    sig = getattr(signal, "SIGUSR1", None)
+    if not DIAGNOSTICS_ENABLED or sig is None:
+        return False
+    try:
+        asyncio.get_running_loop().add_signal_handler(sig, profile_running_jobs)
+    except (NotImplementedError, RuntimeError, ValueError):
+        # Not the main thread, or a loop without signal support
+        return False
+    print(f"🩺 Send SIGUSR1 to process {os.getpid()} to profile its running jobs")
+    return True
+
+def begin_job(job_id: str, profile: bool = False) -> contextvars.Token:
+    """Tag the current context with `job_id` (and profile it if requested). Pair with end_job."""
+    # Start the monitor first so its own ticker task is not attributed to the job
+    monitor = get_monitor()
+    token = JOB_ID.set(job_id)
+    _running_jobs.add(job_id)
+    if monitor is not None and (profile or job_id in _profile_requests):
+        monitor.profile(job_id)
+    return token
+
+def end_job(job_id: str, token: contextvars.Token) -> None:
+    try:
+        JOB_ID.reset(token)
+    except ValueError:
+        # Async generators can be finalized from a different context
+        pass
+    _profile_requests.discard(job_id)
+    _running_jobs.discard(job_id)
+    monitor = _monitors.get(asyncio.get_running_loop()) if DIAGNOSTICS_ENABLED else None
+    if monitor is None:
+        return
+    monitor.finish_profile(job_id)
+    stats = monitor.stats()
+    print(f"🩺 Loop lag max {stats['lag_max_ms']} ms, avg {stats['lag_avg_ms']} ms, stalls so far: {stats['stalls']}")
@@ -0,0 +1,31 @@
+"""
+Size-bounded on-disk caches.
+
+The page text cache and the report export cache both keep plain files under a
+directory and evict the least recently used ones once the directory grows past
+its limit. Files still being written (`*.tmp`) are never counted or removed.
+"""
+import os
+
+def evict_lru(directory: str, max_bytes: float) -> None:
+    """Remove the oldest files under `directory` until it holds at most `max_bytes`."""
+    files = []
+    for root, _, names in os.walk(directory):
+        for name in names:
+            if name.endswith(".tmp"):
+                continue
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+    total = sum(size for _, size, _ in files)
+    for _, size, path in sorted(files):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+            total -= size
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,359 @@
+"""
+Local document store for harvested sources.
+
+Every source fetched by the search agent is kept in an on-disk corpus so later
+runs can answer from it before paying for another web search. Sources the
+deep-fetch stage read in full are indexed, and returned, with their page text. Retrieval mixes
+BM25 over an SQLite inverted index with cosine similarity over a memory-mapped
+NumPy embedding matrix.
+
+Several worker processes may share one store directory. SQLite handles its
+own locking; the embedding file is guarded by an fcntl lock, and each process
+re-maps it whenever another process has grown (replaced) it.
+"""
+import os
+import re
+import math
+import time
+import zlib
+import sqlite3
+import logging
+import threading
+import contextlib
+from collections import Counter
+from dataclasses import dataclass, replace
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: single-process use only
+    fcntl = None
+
+from state import SearchResult, content_hash
+
+logger = logging.getLogger(__name__)
+
+STORE_DIR = os.getenv("DOCUMENT_STORE_DIR", ".research_store")
+STORE_ENABLED = os.getenv("DOCUMENT_STORE_ENABLED", "1") == "1"
+
+EMBEDDING_DIM = 512
+INITIAL_CAPACITY = 1024
+SEARCH_BATCH_ROWS = 8192
+# Vector-only matches below this similarity are noise
+MIN_SIMILARITY = 0.1
+
+# BM25 parameters
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+# When a planned search is considered answered locally
+LOCAL_MIN_HITS = int(os.getenv("LOCAL_MIN_HITS", "3"))
+LOCAL_MIN_COVERAGE = float(os.getenv("LOCAL_MIN_COVERAGE", "0.75"))
+LOCAL_MAX_AGE_DAYS = float(os.getenv("LOCAL_MAX_AGE_DAYS", "7"))
+
+_TOKEN_RE = re.compile(r"[a-z0-9][a-z0-9\-\.]*[a-z0-9]|[a-z0-9]")
+_STOPWORDS = frozenset("""a an and are as at be by for from has have how in is it its of on or
+that the this to was were what when where which who why will with about into than then""".split())
+
+def tokenize(text: str) -> List[str]:
+    """Lower-case word tokens with stopwords removed."""
+    return [t for t in _TOKEN_RE.findall(text.lower()) if t not in _STOPWORDS]
+
+def _bucket(feature: str) -> int:
+    # crc32 is stable across processes, unlike hash()
+    return zlib.crc32(feature.encode("utf-8"))
+
+def embed_texts(texts: List[str]) -> np.ndarray:
+    """Embed texts as L2-normalised hashed bag-of-words (unigrams and bigrams)."""
+    matrix = np.zeros((len(texts), EMBEDDING_DIM), dtype=np.float32)
+    for row, text in enumerate(texts):
+        tokens = tokenize(text)
+        features = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+        for feature, count in Counter(features).items():
+            h = _bucket(feature)
+            sign = 1.0 if h & 0x80000000 else -1.0
+            matrix[row, h % EMBEDDING_DIM] += sign * (1.0 + np.log(count))
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+@dataclass(slots=True, frozen=True)
+class StoreHit:
+    """A stored source matched by a local search."""
+    result: SearchResult
+    score: float
+    coverage: float
+    fetched_at: float
+
+class DocumentStore:
+    """Persistent corpus of fetched sources with hybrid BM25 + vector search."""
+
+    def __init__(self, directory: str = STORE_DIR):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(directory, "index.sqlite3"), check_same_thread=False)
+        self._db.executescript("""
+            PRAGMA journal_mode=WAL;
+            CREATE TABLE IF NOT EXISTS docs (
+                id INTEGER PRIMARY KEY,
+                url TEXT UNIQUE NOT NULL,
+                content_hash TEXT NOT NULL,
+                title TEXT,
+                snippet TEXT,
+                published TEXT,
+                length INTEGER NOT NULL,
+                fetched_at REAL NOT NULL,
+                content TEXT
+            );
+            CREATE TABLE IF NOT EXISTS postings (
+                term TEXT NOT NULL,
+                doc_id INTEGER NOT NULL,
+                tf INTEGER NOT NULL,
+                PRIMARY KEY (term, doc_id)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS postings_doc ON postings(doc_id);
+        """)
+        # Stores created before page text was kept
+        if "content" not in {row[1] for row in self._db.execute("PRAGMA table_info(docs)")}:
+            self._db.execute("ALTER TABLE docs ADD COLUMN content TEXT")
+        self._embeddings_path = os.path.join(directory, "embeddings.npy")
+        self._lock_file = open(os.path.join(directory, "embeddings.lock"), "a+")
+        self._embeddings: Optional[np.ndarray] = None
+        self._mapped_stat = None
+        with self._file_lock(exclusive=True):
+            self._refresh_embeddings()
+
+    # ------------------------------------------------------------------
+    # Embedding matrix (row i holds document id i + 1)
+    # ------------------------------------------------------------------
+    @contextlib.contextmanager
+    def _file_lock(self, exclusive: bool):
+        """Cross-process lock on the embedding file (shared for reads, exclusive for writes)."""
+        if fcntl is None:
+            yield
+            return
+        fcntl.flock(self._lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    def _refresh_embeddings(self) -> None:
+        """(Re)map the embedding file if it is new, or another process replaced or grew it. Call under the file lock."""
+        if not os.path.exists(self._embeddings_path):
+            np.lib.format.open_memmap(
+                self._embeddings_path, mode="w+", dtype=np.float32, shape=(INITIAL_CAPACITY, EMBEDDING_DIM)
+            ).flush()
+        stat = os.stat(self._embeddings_path)
+        if self._embeddings is not None and self._mapped_stat == (stat.st_ino, stat.st_size):
+            return
+        if self._embeddings is not None:
+            self._embeddings.flush()
+        self._embeddings = np.load(self._embeddings_path, mmap_mode="r+")
+        self._mapped_stat = (stat.st_ino, stat.st_size)
+
+    def _ensure_capacity(self, rows: int) -> None:
+        """Grow the embedding file to hold `rows` rows. Call under the exclusive file lock, after a refresh."""
+        capacity = self._embeddings.shape[0]
+        if rows <= capacity:
+            return
+        while capacity < rows:
+            capacity *= 2
+        tmp_path = self._embeddings_path + ".tmp"
+        grown = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=np.float32, shape=(capacity, EMBEDDING_DIM))
+        used = self._embeddings.shape[0]
+        grown[:used] = self._embeddings[:used]
+        grown.flush()
+        del grown
+        self._embeddings.flush()
+        self._embeddings = None
+        os.replace(tmp_path, self._embeddings_path)
+        self._refresh_embeddings()
+
+    # ------------------------------------------------------------------
+    # Writes
+    # ------------------------------------------------------------------
+    def add(self, results: Iterable[SearchResult]) -> int:
+        """Add or refresh sources. Returns how many documents were (re)indexed."""
+        now = time.time()
+        pending = []
+        with self._lock:
+            for result in results:
+                if not result.url:
+                    continue
+                text = f"{result.title}\n{result.snippet}"
+                if result.content:
+                    text += f"\n{result.content}"
+                    digest = content_hash(text)
+                else:
+                    digest = result.content_hash or content_hash(text)
+                row = self._db.execute(
+                    "SELECT id, content_hash, snippet, content FROM docs WHERE url = ?", (result.url,)
+                ).fetchone()
+                # Same content seen again, or a search result for a page already read in full
+                if row and (row[1] == digest or (not result.content and row[3] and row[2] == result.snippet)):
+                    self._db.execute("UPDATE docs SET fetched_at = ? WHERE id = ?", (now, row[0]))
+                    continue
+
+                tokens = tokenize(text)
+                fields = (digest, result.title, result.snippet, result.published, len(tokens), now, result.content or None)
+                if row:
+                    doc_id = row[0]
+                    self._db.execute(
+                        "UPDATE docs SET content_hash=?, title=?, snippet=?, published=?, length=?, fetched_at=?, content=? "
+                        "WHERE id=?",
+                        fields + (doc_id,),
+                    )
+                    self._db.execute("DELETE FROM postings WHERE doc_id = ?", (doc_id,))
+                else:
+                    doc_id = self._db.execute(
+                        "INSERT INTO docs (url, content_hash, title, snippet, published, length, fetched_at, content) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                        (result.url,) + fields,
+                    ).lastrowid
+                self._db.executemany(
+                    "INSERT INTO postings (term, doc_id, tf) VALUES (?, ?, ?)",
+                    [(term, doc_id, tf) for term, tf in Counter(tokens).items()],
+                )
+                pending.append((doc_id, text))
+
+            if pending:
+                vectors = embed_texts([text for _, text in pending])
+                with self._file_lock(exclusive=True):
+                    # Another process may have grown the file since we mapped it
+                    self._refresh_embeddings()
+                    self._ensure_capacity(max(doc_id for doc_id, _ in pending))
+                    for (doc_id, _), vector in zip(pending, vectors):
+                        self._embeddings[doc_id - 1] = vector
+                    self._embeddings.flush()
+            self._db.commit()
+        if pending:
+            logger.info(f"Indexed {len(pending)} sources into local store")
+        return len(pending)
+
+    # ------------------------------------------------------------------
+    # Reads
+    # ------------------------------------------------------------------
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM docs").fetchone()[0]
+
+    def _bm25(self, terms: List[str]) -> Dict[int, float]:
+        total, avg_len = self._db.execute("SELECT COUNT(*), AVG(length) FROM docs").fetchone()
+        if not total:
+            return {}
+        avg_len = avg_len or 1.0
+        scores: Dict[int, float] = {}
+        for term in set(terms):
+            postings = self._db.execute(
+                "SELECT p.doc_id, p.tf, d.length FROM postings p JOIN docs d ON d.id = p.doc_id WHERE p.term = ?",
+                (term,),
+            ).fetchall()
+            if not postings:
+                continue
+            idf = math.log(1.0 + (total - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc_id, tf, length in postings:
+                norm = tf + BM25_K1 * (1 - BM25_B + BM25_B * length / avg_len)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (BM25_K1 + 1) / norm
+        return scores
+
+    def _cosine(self, query: str, rows: int, k: int) -> Dict[int, float]:
+        if rows == 0:
+            return {}
+        vector = embed_texts([query])[0]
+        best_ids: List[np.ndarray] = []
+        best_scores: List[np.ndarray] = []
+        for start in range(0, rows, SEARCH_BATCH_ROWS):
+            sims = self._embeddings[start:min(rows, start + SEARCH_BATCH_ROWS)] @ vector
+            top = np.argpartition(-sims, min(k, len(sims) - 1))[:k]
+            best_ids.append(top + start)
+            best_scores.append(sims[top])
+        ids = np.concatenate(best_ids)
+        sims = np.concatenate(best_scores)
+        order = np.argsort(-sims)[:k]
+        return {int(ids[i]) + 1: float(sims[i]) for i in order}
+
+    def search(self, query: str, k: int = 5, max_age_days: Optional[float] = None) -> List[StoreHit]:
+        """Hybrid search: normalised BM25 and cosine similarity, equally weighted."""
+        terms = tokenize(query)
+        if not terms:
+            return []
+        with self._lock:
+            rows = self._db.execute("SELECT COALESCE(MAX(id), 0) FROM docs").fetchone()[0]
+            lexical = self._bm25(terms)
+            with self._file_lock(exclusive=False):
+                self._refresh_embeddings()
+                semantic = self._cosine(query, min(rows, self._embeddings.shape[0]), k * 4)
+            candidates = set(sorted(lexical, key=lexical.get, reverse=True)[:k * 4]) | set(semantic)
+            if not candidates:
+                return []
+            top_lexical = max(lexical.values(), default=0.0) or 1.0
+
+            cutoff = time.time() - max_age_days * 86400 if max_age_days is not None else 0.0
+            placeholders = ",".join("?" * len(candidates))
+            docs = self._db.execute(
+                f"SELECT id, url, title, snippet, published, content_hash, fetched_at, content FROM docs "
+                f"WHERE id IN ({placeholders}) AND fetched_at >= ?",
+                (*candidates, cutoff),
+            ).fetchall()
+            doc_terms: Dict[int, set] = {}
+            for doc_id, term in self._db.execute(
+                f"SELECT doc_id, term FROM postings WHERE doc_id IN ({placeholders}) "
+                f"AND term IN ({','.join('?' * len(set(terms)))})",
+                (*candidates, *set(terms)),
+            ):
+                doc_terms.setdefault(doc_id, set()).add(term)
+
+        unique_terms = set(terms)
+        hits = []
+        for doc_id, url, title, snippet, published, digest, fetched_at, content in docs:
+            similarity = semantic.get(doc_id, 0.0)
+            if doc_id not in lexical and similarity < MIN_SIMILARITY:
+                continue
+            score = float(0.5 * lexical.get(doc_id, 0.0) / top_lexical + 0.5 * max(similarity, 0.0))
+            result = SearchResult(
+                url=url, title=title or "", snippet=snippet or "", published=published or "",
+                content_hash=digest, content=content or "",
+            )
+            hits.append(StoreHit(
+                result=replace(result, score=round(score, 4)),
+                score=score,
+                coverage=len(doc_terms.get(doc_id, ())) / len(unique_terms),
+                fetched_at=fetched_at,
+            ))
+        hits.sort(key=lambda h: h.score, reverse=True)
+        return hits[:k]
+
+    def answer_locally(self, query: str) -> Optional[List[SearchResult]]:
+        """Return stored sources if they cover the query well enough to skip the web."""
+        hits = self.search(query, k=LOCAL_MIN_HITS, max_age_days=LOCAL_MAX_AGE_DAYS)
+        good = [h for h in hits if h.coverage >= LOCAL_MIN_COVERAGE]
+        if len(good) < LOCAL_MIN_HITS:
+            return None
+        return [h.result for h in good]
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+            self._embeddings.flush()
+            self._lock_file.close()
+
+_store: Optional[DocumentStore] = None
+_store_lock = threading.Lock()
+
+def get_document_store() -> Optional[DocumentStore]:
+    """Shared store for this process, or None when disabled or unavailable."""
+    global _store
+    if not STORE_ENABLED:
+        return None
+    with _store_lock:
+        if _store is None:
+            try:
+                _store = DocumentStore()
+            except Exception as e:
+                logger.error(f"Local document store unavailable: {e}")
+                return None
+        return _store
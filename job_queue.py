@@ -0,0 +1,460 @@
+"""
+Job queue for running research jobs on a fleet of worker processes.
+
+Front ends enqueue a query and read the job's event stream; workers (see
+worker.py) lease jobs, run the research graph and publish every chunk back.
+Leases must be renewed by heartbeats: a job whose worker stops heartbeating
+is handed to another worker, up to MAX_ATTEMPTS times.
+
+Backends:
+- InMemoryJobQueue: thread-safe, single process. For tests and local runs.
+- RedisJobQueue: shared by any number of processes and machines.
+"""
+import os
+import json
+import time
+import uuid
+import asyncio
+import logging
+import threading
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, AsyncGenerator, Dict, List, Optional
+
+from state import ReportReady
+
+logger = logging.getLogger(__name__)
+
+QUEUE_URL = os.getenv("RESEARCH_QUEUE_URL", "")
+
+LEASE_SECONDS = 30.0
+HEARTBEAT_INTERVAL = 10.0
+MAX_ATTEMPTS = 3
+RESULT_TTL = 24 * 3600
+EVENT_POLL_TIMEOUT = 5.0
+# Redis calls fail after this long instead of hanging (blocking reads get EVENT_POLL_TIMEOUT on top)
+REDIS_SOCKET_TIMEOUT = float(os.getenv("RESEARCH_QUEUE_TIMEOUT", "5"))
+# A client gives up on a job that produced no event for this long
+CLIENT_IDLE_TIMEOUT = 15 * 60.0
+
+# Event types published on a job's stream
+CHUNK = "chunk"        # a piece of streamed output, same as ResearchManager.run yields
+REPORT = "report"      # the finished report as JSON (a ReportReady marker from ResearchManager.run)
+RESTART = "restart"    # the job was redelivered; clients discard output received so far
+DONE = "done"
+ERROR = "error"
+TERMINAL_EVENTS = (DONE, ERROR)
+
+ABANDONED_MESSAGE = "Job abandoned: worker stopped responding"
+# Yielded by QueuedResearchManager on RESTART; front ends reset their output when they see it
+RESTART_BANNER = "**🔁 Worker lost, restarting job...**\n\n"
+CANCELLED_MESSAGE = "Job cancelled"
+
+@dataclass(slots=True)
+class Job:
+    job_id: str
+    query: str
+    attempts: int = 0
+    options: Dict[str, Any] = field(default_factory=dict)  # keyword arguments for ResearchManager.run
+
+@dataclass(slots=True)
+class JobEvent:
+    seq: str
+    type: str
+    data: str = ""
+
+class JobQueue:
+    """Interface shared by all queue backends. All methods are blocking and thread-safe."""
+
+    def enqueue(self, query: str, options: Optional[Dict[str, Any]] = None) -> str:
+        raise NotImplementedError
+
+    def lease(self, worker_id: str) -> Optional[Job]:
+        """Take the next pending job, or None when the queue is empty."""
+        raise NotImplementedError
+
+    def heartbeat(self, job_id: str, worker_id: str) -> bool:
+        """Extend a lease. False means the lease was lost and the job must be abandoned."""
+        raise NotImplementedError
+
+    def complete(self, job_id: str, worker_id: str, error: str = "") -> None:
+        """Release a finished job and publish its terminal event."""
+        raise NotImplementedError
+
+    def publish(self, job_id: str, type: str, data: str = "") -> None:
+        raise NotImplementedError
+
+    def publish_output(self, job_id: str, worker_id: str, data: str, type: str = CHUNK) -> bool:
+        """Publish a CHUNK (or REPORT) only if `worker_id` still holds the job's lease and it was not cancelled.
+
+        False means the job must be abandoned.
+        """
+        raise NotImplementedError
+
+    def read_events(self, job_id: str, after: str = "", timeout: float = EVENT_POLL_TIMEOUT) -> List[JobEvent]:
+        """Events published after sequence id `after`, waiting up to `timeout` for new ones."""
+        raise NotImplementedError
+
+    def requeue_expired(self) -> int:
+        """Redeliver jobs whose lease ran out. Returns how many were redelivered or failed."""
+        raise NotImplementedError
+
+    def cancel(self, job_id: str) -> None:
+        """Drop a job: it is never leased again and its worker's next heartbeat or chunk fails."""
+        raise NotImplementedError
+
+    def request_profile(self, job_id: str) -> bool:
+        """Ask the worker running (or about to run) a job to profile it. False if the job is unknown or finished."""
+        raise NotImplementedError
+
+    def take_profile_request(self, job_id: str) -> bool:
+        """True once after request_profile was called for the job; checked by workers as they heartbeat."""
+        raise NotImplementedError
+
+class InMemoryJobQueue(JobQueue):
+    """Single-process backend with the same lease and redelivery semantics as Redis."""
+
+    def __init__(self, lease_seconds: float = LEASE_SECONDS):
+        self.lease_seconds = lease_seconds
+        self._cond = threading.Condition()
+        self._pending: deque = deque()
+        self._jobs: Dict[str, Job] = {}
+        self._leases: Dict[str, tuple] = {}  # job_id -> (worker_id, expires_at)
+        self._events: Dict[str, List[JobEvent]] = {}
+        self._finished: Dict[str, float] = {}  # job_id -> finished_at
+        self._cancelled: set = set()
+        self._profile_requests: set = set()
+        self._seq = 0
+
+    def _purge_finished(self) -> None:
+        cutoff = time.monotonic() - RESULT_TTL
+        for job_id in [j for j, finished_at in self._finished.items() if finished_at < cutoff]:
+            del self._finished[job_id]
+            self._cancelled.discard(job_id)
+            self._profile_requests.discard(job_id)
+            self._jobs.pop(job_id, None)
+            self._events.pop(job_id, None)
+
+    def enqueue(self, query: str, options: Optional[Dict[str, Any]] = None) -> str:
+        job = Job(job_id=uuid.uuid4().hex, query=query, options=dict(options or {}))
+        with self._cond:
+            self._purge_finished()
+            self._jobs[job.job_id] = job
+            self._events[job.job_id] = []
+            self._pending.append(job.job_id)
+        return job.job_id
+
+    def lease(self, worker_id: str) -> Optional[Job]:
+        with self._cond:
+            if not self._pending:
+                return None
+            job = self._jobs[self._pending.popleft()]
+            job.attempts += 1
+            self._leases[job.job_id] = (worker_id, time.monotonic() + self.lease_seconds)
+            return Job(job.job_id, job.query, job.attempts, dict(job.options))
+
+    def heartbeat(self, job_id: str, worker_id: str) -> bool:
+        with self._cond:
+            lease = self._leases.get(job_id)
+            if lease is None or lease[0] != worker_id:
+                return False
+            if job_id in self._cancelled:
+                del self._leases[job_id]
+                return False
+            self._leases[job_id] = (worker_id, time.monotonic() + self.lease_seconds)
+            return True
+
+    def complete(self, job_id: str, worker_id: str, error: str = "") -> None:
+        with self._cond:
+            lease = self._leases.get(job_id)
+            if lease is None or lease[0] != worker_id:
+                return
+            del self._leases[job_id]
+            self._finished[job_id] = time.monotonic()
+            self.publish(job_id, ERROR if error else DONE, error)
+
+    def publish(self, job_id: str, type: str, data: str = "") -> None:
+        with self._cond:
+            self._seq += 1
+            self._events.setdefault(job_id, []).append(JobEvent(seq=str(self._seq), type=type, data=data))
+            self._cond.notify_all()
+
+    def publish_output(self, job_id: str, worker_id: str, data: str, type: str = CHUNK) -> bool:
+        with self._cond:
+            lease = self._leases.get(job_id)
+            if lease is None or lease[0] != worker_id:
+                return False
+            if job_id in self._cancelled:
+                del self._leases[job_id]
+                return False
+            self.publish(job_id, type, data)
+            return True
+
+    def read_events(self, job_id: str, after: str = "", timeout: float = EVENT_POLL_TIMEOUT) -> List[JobEvent]:
+        after_seq = int(after or 0)
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                events = [e for e in self._events.get(job_id, []) if int(e.seq) > after_seq]
+                remaining = deadline - time.monotonic()
+                if events or remaining <= 0:
+                    return events
+                self._cond.wait(remaining)
+
+    def requeue_expired(self) -> int:
+        now = time.monotonic()
+        with self._cond:
+            expired = [job_id for job_id, (_, expires_at) in self._leases.items() if expires_at < now]
+            for job_id in expired:
+                del self._leases[job_id]
+                if job_id in self._cancelled:
+                    continue
+                # The event goes out before redelivery so it precedes the new attempt's output
+                if self._jobs[job_id].attempts < MAX_ATTEMPTS:
+                    self.publish(job_id, RESTART)
+                    self._pending.append(job_id)
+                else:
+                    self._finished[job_id] = now
+                    self.publish(job_id, ERROR, ABANDONED_MESSAGE)
+        return len(expired)
+
+    def cancel(self, job_id: str) -> None:
+        with self._cond:
+            if job_id not in self._jobs or job_id in self._finished:
+                return
+            self._cancelled.add(job_id)
+            self._finished[job_id] = time.monotonic()
+            if job_id in self._pending:
+                self._pending.remove(job_id)
+            self.publish(job_id, ERROR, CANCELLED_MESSAGE)
+
+    def request_profile(self, job_id: str) -> bool:
+        with self._cond:
+            if job_id not in self._jobs or job_id in self._finished:
+                return False
+            self._profile_requests.add(job_id)
+            return True
+
+    def take_profile_request(self, job_id: str) -> bool:
+        with self._cond:
+            if job_id not in self._profile_requests:
+                return False
+            self._profile_requests.discard(job_id)
+            return True
+
+# Atomically move the next pending job into the lease set
+_LEASE_SCRIPT = """
+local job_id = redis.call('RPOP', KEYS[1])
+if not job_id then return nil end
+redis.call('ZADD', KEYS[2], ARGV[1], job_id)
+local job_key = ARGV[3] .. job_id
+redis.call('HSET', job_key, 'worker', ARGV[2])
+local attempts = redis.call('HINCRBY', job_key, 'attempts', 1)
+return {job_id, redis.call('HGET', job_key, 'query'), attempts, redis.call('HGET', job_key, 'options')}
+"""
+
+# Extend a lease only if this worker still owns it and the job was not cancelled
+_HEARTBEAT_SCRIPT = """
+if redis.call('HGET', KEYS[2], 'worker') ~= ARGV[2] then return 0 end
+if not redis.call('ZSCORE', KEYS[1], ARGV[3]) then return 0 end
+if redis.call('HGET', KEYS[2], 'cancelled') == '1' then
+    redis.call('ZREM', KEYS[1], ARGV[3])
+    return 0
+end
+redis.call('ZADD', KEYS[1], ARGV[1], ARGV[3])
+return 1
+"""
+
+# Release a lease only if this worker still owns it
+_COMPLETE_SCRIPT = """
+if redis.call('HGET', KEYS[2], 'worker') ~= ARGV[1] then return 0 end
+return redis.call('ZREM', KEYS[1], ARGV[2])
+"""
+
+# Append a chunk only if this worker still holds the lease and the job was not cancelled
+_PUBLISH_OUTPUT_SCRIPT = """
+if redis.call('HGET', KEYS[2], 'worker') ~= ARGV[1] then return 0 end
+if not redis.call('ZSCORE', KEYS[1], ARGV[2]) then return 0 end
+if redis.call('HGET', KEYS[2], 'cancelled') == '1' then
+    redis.call('ZREM', KEYS[1], ARGV[2])
+    return 0
+end
+redis.call('XADD', KEYS[3], '*', 'type', ARGV[3], 'data', ARGV[4])
+redis.call('EXPIRE', KEYS[3], ARGV[5])
+return 1
+"""
+
+# Take an expired lease back and redeliver or fail the job.
+# Returns attempts so far, or -1 if another worker got there first.
+_EXPIRE_SCRIPT = """
+if redis.call('ZREM', KEYS[1], ARGV[1]) == 0 then return -1 end
+redis.call('HDEL', KEYS[2], 'worker')
+if redis.call('HGET', KEYS[2], 'cancelled') == '1' then return -1 end
+local attempts = tonumber(redis.call('HGET', KEYS[2], 'attempts') or '0')
+if attempts < tonumber(ARGV[2]) then
+    redis.call('XADD', KEYS[4], '*', 'type', ARGV[3], 'data', '')
+    redis.call('LPUSH', KEYS[3], ARGV[1])
+else
+    redis.call('XADD', KEYS[4], '*', 'type', ARGV[4], 'data', ARGV[5])
+end
+return attempts
+"""
+
+class RedisJobQueue(JobQueue):
+    """Backend shared by workers on any number of machines (requires the redis package)."""
+
+    def __init__(self, url: str, prefix: str = "research", lease_seconds: float = LEASE_SECONDS):
+        import redis
+
+        self.lease_seconds = lease_seconds
+        self.redis = redis.Redis.from_url(
+            url, decode_responses=True, socket_connect_timeout=REDIS_SOCKET_TIMEOUT,
+            socket_timeout=EVENT_POLL_TIMEOUT + REDIS_SOCKET_TIMEOUT,
+        )
+        self.pending_key = f"{prefix}:pending"
+        self.leases_key = f"{prefix}:leases"
+        self.job_prefix = f"{prefix}:job:"
+        self.events_prefix = f"{prefix}:events:"
+        self._lease = self.redis.register_script(_LEASE_SCRIPT)
+        self._heartbeat = self.redis.register_script(_HEARTBEAT_SCRIPT)
+        self._complete = self.redis.register_script(_COMPLETE_SCRIPT)
+        self._publish_output = self.redis.register_script(_PUBLISH_OUTPUT_SCRIPT)
+        self._expire = self.redis.register_script(_EXPIRE_SCRIPT)
+
+    def enqueue(self, query: str, options: Optional[Dict[str, Any]] = None) -> str:
+        job_id = uuid.uuid4().hex
+        job = {"query": query, "attempts": 0, "created_at": time.time(), "options": json.dumps(options or {})}
+        pipe = self.redis.pipeline()
+        pipe.hset(self.job_prefix + job_id, mapping=job)
+        pipe.expire(self.job_prefix + job_id, RESULT_TTL)
+        pipe.lpush(self.pending_key, job_id)
+        pipe.execute()
+        return job_id
+
+    def lease(self, worker_id: str) -> Optional[Job]:
+        # Lease scores are wall-clock timestamps because they are compared across machines
+        leased = self._lease(
+            keys=[self.pending_key, self.leases_key],
+            args=[time.time() + self.lease_seconds, worker_id, self.job_prefix],
+        )
+        if not leased:
+            return None
+        job_id, query, attempts, options = leased
+        return Job(job_id=job_id, query=query, attempts=int(attempts), options=json.loads(options or "{}"))
+
+    def heartbeat(self, job_id: str, worker_id: str) -> bool:
+        return bool(self._heartbeat(
+            keys=[self.leases_key, self.job_prefix + job_id],
+            args=[time.time() + self.lease_seconds, worker_id, job_id],
+        ))
+
+    def complete(self, job_id: str, worker_id: str, error: str = "") -> None:
+        released = self._complete(keys=[self.leases_key, self.job_prefix + job_id], args=[worker_id, job_id])
+        if released:
+            self.publish(job_id, ERROR if error else DONE, error)
+
+    def publish(self, job_id: str, type: str, data: str = "") -> None:
+        key = self.events_prefix + job_id
+        pipe = self.redis.pipeline()
+        pipe.xadd(key, {"type": type, "data": data})
+        pipe.expire(key, RESULT_TTL)
+        pipe.execute()
+
+    def publish_output(self, job_id: str, worker_id: str, data: str, type: str = CHUNK) -> bool:
+        return bool(self._publish_output(
+            keys=[self.leases_key, self.job_prefix + job_id, self.events_prefix + job_id],
+            args=[worker_id, job_id, type, data, RESULT_TTL],
+        ))
+
+    def read_events(self, job_id: str, after: str = "", timeout: float = EVENT_POLL_TIMEOUT) -> List[JobEvent]:
+        response = self.redis.xread({self.events_prefix + job_id: after or "0-0"}, block=int(timeout * 1000))
+        if not response:
+            return []
+        _, entries = response[0]
+        return [JobEvent(seq=seq, type=fields.get("type", ""), data=fields.get("data", "")) for seq, fields in entries]
+
+    def requeue_expired(self) -> int:
+        expired = self.redis.zrangebyscore(self.leases_key, "-inf", time.time())
+        handled = 0
+        for job_id in expired:
+            attempts = self._expire(
+                keys=[self.leases_key, self.job_prefix + job_id, self.pending_key, self.events_prefix + job_id],
+                args=[job_id, MAX_ATTEMPTS, RESTART, ERROR, ABANDONED_MESSAGE],
+            )
+            if attempts < 0:
+                continue
+            handled += 1
+            logger.warning(f"Lease lost for job {job_id} after attempt {attempts}")
+        return handled
+
+    def cancel(self, job_id: str) -> None:
+        pipe = self.redis.pipeline()
+        pipe.hset(self.job_prefix + job_id, "cancelled", 1)
+        pipe.lrem(self.pending_key, 0, job_id)
+        pipe.execute()
+        self.publish(job_id, ERROR, CANCELLED_MESSAGE)
+
+    def request_profile(self, job_id: str) -> bool:
+        key = self.job_prefix + job_id
+        if not self.redis.exists(key) or self.redis.hget(key, "cancelled") == "1":
+            return False
+        self.redis.hset(key, "profile", 1)
+        return True
+
+    def take_profile_request(self, job_id: str) -> bool:
+        return self.redis.hdel(self.job_prefix + job_id, "profile") == 1
+
+def create_job_queue(url: str = QUEUE_URL) -> JobQueue:
+    """Build a queue backend from a URL: memory:// or redis://host:port/db."""
+    if url.startswith("memory://"):
+        return InMemoryJobQueue()
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisJobQueue(url)
+    raise ValueError(f"Unsupported research queue URL: {url!r}")
+
+class QueuedResearchManager:
+    """Front-end stand-in for ResearchManager that runs jobs on the worker fleet."""
+
+    def __init__(self, queue: JobQueue):
+        self.queue = queue
+
+    async def run(self, user_query: str, **options) -> AsyncGenerator[str, None]:
+        """Enqueue a job and stream its output, like ResearchManager.run (same keyword options)."""
+        job_id = await asyncio.to_thread(self.queue.enqueue, user_query, options)
+        print(f"📮 Queued research job {job_id}: {user_query}")
+        yield f"**📮 Job {job_id[:8]} queued**\n\n"
+
+        cursor = ""
+        idle_since = time.monotonic()
+        finished = False
+        try:
+            while True:
+                events = await asyncio.to_thread(self.queue.read_events, job_id, cursor)
+                if not events:
+                    if time.monotonic() - idle_since > CLIENT_IDLE_TIMEOUT:
+                        yield "## ❌ Research Failed\n\n**Error:** No response from research workers.\n\n"
+                        return
+                    continue
+                idle_since = time.monotonic()
+                for event in events:
+                    cursor = event.seq
+                    if event.type == CHUNK:
+                        yield event.data
+                    elif event.type == REPORT:
+                        yield ReportReady.from_json(event.data)
+                    elif event.type == RESTART:
+                        yield RESTART_BANNER
+                    elif event.type in TERMINAL_EVENTS:
+                        finished = True
+                        if event.type == ERROR:
+                            yield f"## ❌ Research Failed\n\n**Error:** {event.data[:200]}\n\n"
+                        return
+        finally:
+            # The client went away (or gave up): stop the worker spending on it
+            if not finished:
+                print(f"🛑 Cancelling research job {job_id}")
+                try:
+                    await asyncio.to_thread(self.queue.cancel, job_id)
+                except Exception as e:
+                    # The worker finishes the job unseen; nothing else to do from here
+                    logger.error(f"Could not cancel research job {job_id}: {e}")
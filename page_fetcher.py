@@ -0,0 +1,306 @@
+"""
+Deep-fetch stage: download the top search result pages and extract their main text.
+
+Pages are fetched concurrently through one pooled async client with a global
+and a per-host concurrency limit. HTML is decoded and parsed incrementally as
+it streams in, so no page is ever held in memory in full, and every job has a
+total byte budget. Extracted text is cached on disk by URL and content hash,
+up to PAGE_CACHE_MAX_MB.
+
+Search results are untrusted, so only http(s) URLs whose host resolves to
+public addresses are fetched. Redirects are followed by hand and every hop is
+checked the same way, so a public page cannot bounce the fetcher onto
+localhost, the LAN or a cloud metadata endpoint.
+"""
+import os
+import time
+import codecs
+import socket
+import asyncio
+import hashlib
+import logging
+import ipaddress
+from dataclasses import replace
+from html.parser import HTMLParser
+from typing import Dict, List, Optional
+from urllib.parse import urlsplit
+
+import httpx
+
+from state import SearchResult, content_hash
+from disk_cache import evict_lru
+
+logger = logging.getLogger(__name__)
+
+DEEP_FETCH_ENABLED = os.getenv("DEEP_FETCH", "0") == "1"
+FETCH_TOP_N = int(os.getenv("DEEP_FETCH_TOP_N", "2"))
+
+MAX_CONCURRENCY = 8
+MAX_PER_HOST = 2
+FETCH_TIMEOUT = 10.0
+MAX_PAGE_BYTES = 1_000_000
+MAX_JOB_BYTES = 8_000_000
+MAX_TEXT_CHARS = 8000
+MIN_PARAGRAPH_WORDS = 8
+MAX_REDIRECTS = 5
+
+CACHE_DIR = os.getenv("PAGE_CACHE_DIR", os.path.join(".research_store", "pages"))
+CACHE_MAX_AGE = 7 * 86400
+PAGE_CACHE_MAX_MB = float(os.getenv("PAGE_CACHE_MAX_MB", "200"))
+# Seconds between size checks of the cache directory, per process
+CACHE_PRUNE_INTERVAL = 600
+
+USER_AGENT = "Mozilla/5.0 (compatible; DeepResearchBot/0.1)"
+
+# Elements whose text is never part of the article body
+_SKIP_TAGS = frozenset({
+    "script", "style", "noscript", "template", "svg", "iframe", "canvas",
+    "nav", "header", "footer", "aside", "form", "button", "select", "menu",
+})
+# Elements that end a paragraph
+_BLOCK_TAGS = frozenset({
+    "p", "div", "section", "article", "main", "br", "li", "ul", "ol", "table",
+    "tr", "td", "th", "h1", "h2", "h3", "h4", "h5", "h6", "blockquote", "pre",
+})
+# Void elements never get an end tag, so they must not open a skipped region
+_VOID_TAGS = frozenset({"br", "img", "input", "meta", "link", "hr", "source", "wbr"})
+
+class BlockedURL(ValueError):
+    """A URL the fetcher refuses: not http(s), not public, or too many redirects."""
+
+def _is_public(address: str) -> bool:
+    ip = ipaddress.ip_address(address.split("%", 1)[0])
+    if isinstance(ip, ipaddress.IPv6Address) and ip.ipv4_mapped is not None:
+        ip = ip.ipv4_mapped
+    # is_global excludes private, loopback, link-local, shared and reserved ranges
+    return ip.is_global and not ip.is_multicast
+
+async def check_public_url(url: str) -> None:
+    """Raise BlockedURL unless `url` is http(s) and its host only resolves to public addresses."""
+    parts = urlsplit(url)
+    if parts.scheme not in ("http", "https") or not parts.hostname:
+        raise BlockedURL(f"Not a web URL: {url}")
+    try:
+        port = parts.port or (443 if parts.scheme == "https" else 80)
+        infos = await asyncio.get_running_loop().getaddrinfo(parts.hostname, port, type=socket.SOCK_STREAM)
+    except (OSError, ValueError) as e:
+        raise BlockedURL(f"Cannot resolve {parts.hostname}: {e}")
+    addresses = {info[4][0] for info in infos}
+    if not addresses or not all(_is_public(address) for address in addresses):
+        raise BlockedURL(f"{parts.hostname} resolves to a non-public address")
+
+class _TextExtractor(HTMLParser):
+    """Incremental HTML-to-text converter that drops boilerplate elements."""
+
+    def __init__(self, max_chars: int = MAX_TEXT_CHARS):
+        super().__init__(convert_charrefs=True)
+        self.max_chars = max_chars
+        self.paragraphs: List[str] = []
+        self._chars = 0
+        self._skip_depth = 0
+        self._current: List[str] = []
+
+    @property
+    def full(self) -> bool:
+        return self._chars >= self.max_chars
+
+    def handle_starttag(self, tag, attrs):
+        if tag in _SKIP_TAGS and tag not in _VOID_TAGS:
+            self._skip_depth += 1
+        elif tag in _BLOCK_TAGS:
+            self._end_paragraph()
+
+    def handle_endtag(self, tag):
+        if tag in _SKIP_TAGS and tag not in _VOID_TAGS:
+            self._skip_depth = max(0, self._skip_depth - 1)
+        elif tag in _BLOCK_TAGS:
+            self._end_paragraph()
+
+    def handle_data(self, data):
+        if not self._skip_depth and not self.full:
+            self._current.append(data)
+
+    def _end_paragraph(self):
+        text = " ".join("".join(self._current).split())
+        self._current = []
+        # Short fragments are menus, bylines, buttons and link lists
+        if len(text.split()) < MIN_PARAGRAPH_WORDS or self.full:
+            return
+        text = text[:self.max_chars - self._chars]
+        self.paragraphs.append(text)
+        self._chars += len(text)
+
+    def text(self) -> str:
+        self._end_paragraph()
+        return "\n\n".join(self.paragraphs)
+
+_last_prune = 0.0
+
+class PageCache:
+    """On-disk cache of extracted page text, keyed by URL and by content hash.
+
+    Texts are evicted least recently used first once they pass PAGE_CACHE_MAX_MB.
+    """
+
+    def __init__(self, directory: str = CACHE_DIR, max_mb: float = PAGE_CACHE_MAX_MB):
+        self.max_bytes = max_mb * 1024 * 1024
+        self.url_dir = os.path.join(directory, "urls")
+        self.text_dir = os.path.join(directory, "texts")
+        os.makedirs(self.url_dir, exist_ok=True)
+        os.makedirs(self.text_dir, exist_ok=True)
+
+    def _url_path(self, url: str) -> str:
+        return os.path.join(self.url_dir, hashlib.sha1(url.encode("utf-8")).hexdigest())
+
+    def get(self, url: str) -> Optional[str]:
+        path = self._url_path(url)
+        try:
+            if time.time() - os.path.getmtime(path) > CACHE_MAX_AGE:
+                return None
+            with open(path, encoding="utf-8") as f:
+                digest = f.read().strip()
+            text_path = os.path.join(self.text_dir, f"{digest}.txt")
+            with open(text_path, encoding="utf-8") as f:
+                text = f.read()
+            # Mark as recently used for pruning
+            os.utime(text_path)
+            return text
+        except OSError:
+            return None
+
+    def put(self, url: str, text: str) -> None:
+        digest = content_hash(text)
+        text_path = os.path.join(self.text_dir, f"{digest}.txt")
+        # Identical pages served under different URLs are stored once
+        if not os.path.exists(text_path):
+            tmp = f"{text_path}.{os.getpid()}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                f.write(text)
+            os.replace(tmp, text_path)
+        with open(self._url_path(url), "w", encoding="utf-8") as f:
+            f.write(digest)
+
+        global _last_prune
+        if time.monotonic() - _last_prune > CACHE_PRUNE_INTERVAL or not _last_prune:
+            _last_prune = time.monotonic()
+            self.prune()
+
+    def prune(self) -> None:
+        """Drop expired URL entries and evict least recently used texts while over the size limit."""
+        now = time.time()
+        for name in os.listdir(self.url_dir):
+            path = os.path.join(self.url_dir, name)
+            try:
+                if now - os.path.getmtime(path) > CACHE_MAX_AGE:
+                    os.remove(path)
+            except FileNotFoundError:
+                pass
+
+        # URL entries pointing at evicted texts now miss and the page is fetched again
+        evict_lru(self.text_dir, self.max_bytes)
+
+class PageFetcher:
+    """Pooled, bounded page downloader for one research job.
+
+    Use as an async context manager so the connection pool is closed:
+
+        async with PageFetcher() as fetcher:
+            enriched = await fetcher.enrich(results)
+    """
+
+    def __init__(self, max_job_bytes: int = MAX_JOB_BYTES, cache: Optional[PageCache] = None):
+        self.max_job_bytes = max_job_bytes
+        self.bytes_used = 0
+        self.cache = cache if cache is not None else PageCache()
+        self._client: Optional[httpx.AsyncClient] = None
+        self._slots = asyncio.Semaphore(MAX_CONCURRENCY)
+        self._host_slots: Dict[str, asyncio.Semaphore] = {}
+
+    async def __aenter__(self) -> "PageFetcher":
+        self._client = httpx.AsyncClient(
+            timeout=FETCH_TIMEOUT,
+            # Redirects are followed in _stream_extract so each hop is checked
+            follow_redirects=False,
+            headers={"User-Agent": USER_AGENT, "Accept": "text/html,text/plain;q=0.9"},
+            limits=httpx.Limits(max_connections=MAX_CONCURRENCY, max_keepalive_connections=MAX_CONCURRENCY),
+        )
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def _host_slot(self, url: str) -> asyncio.Semaphore:
+        host = urlsplit(url).netloc.lower()
+        if host not in self._host_slots:
+            self._host_slots[host] = asyncio.Semaphore(MAX_PER_HOST)
+        return self._host_slots[host]
+
+    async def fetch_text(self, url: str) -> str:
+        """Return the extracted main text of a page, or "" if it cannot be fetched."""
+        cached = await asyncio.to_thread(self.cache.get, url)
+        if cached is not None:
+            return cached
+        if self._client is None:
+            raise RuntimeError("PageFetcher must be used as an async context manager")
+
+        async with self._host_slot(url), self._slots:
+            if self.bytes_used >= self.max_job_bytes:
+                logger.info(f"Deep-fetch byte budget exhausted, skipping {url}")
+                return ""
+            try:
+                text = await self._stream_extract(url)
+            except BlockedURL as e:
+                logger.warning(f"Deep-fetch refused {url}: {e}")
+                return ""
+            except (httpx.HTTPError, UnicodeError, LookupError) as e:
+                logger.warning(f"Deep-fetch failed for {url}: {e}")
+                return ""
+
+        if text:
+            try:
+                await asyncio.to_thread(self.cache.put, url, text)
+            except OSError as e:
+                logger.warning(f"Could not cache page text for {url}: {e}")
+        return text
+
+    async def _stream_extract(self, url: str) -> str:
+        for _ in range(MAX_REDIRECTS + 1):
+            await check_public_url(url)
+            async with self._client.stream("GET", url) as response:
+                if response.next_request is not None:
+                    url = str(response.next_request.url)
+                    continue
+                response.raise_for_status()
+                return await self._extract(response)
+        raise BlockedURL(f"More than {MAX_REDIRECTS} redirects")
+
+    async def _extract(self, response: httpx.Response) -> str:
+        """Stream a response through the text extractor, within the page and job byte budgets."""
+        content_type = response.headers.get("content-type", "")
+        if "html" not in content_type and "text/plain" not in content_type:
+            return ""
+
+        decoder = codecs.getincrementaldecoder(response.charset_encoding or "utf-8")(errors="replace")
+        parser = _TextExtractor()
+        page_bytes = 0
+        async for chunk in response.aiter_bytes():
+            page_bytes += len(chunk)
+            self.bytes_used += len(chunk)
+            parser.feed(decoder.decode(chunk))
+            if parser.full or page_bytes >= MAX_PAGE_BYTES or self.bytes_used >= self.max_job_bytes:
+                break
+        parser.feed(decoder.decode(b"", final=True))
+        parser.close()
+        return parser.text()
+
+    async def enrich(self, results: List[SearchResult], top_n: int = FETCH_TOP_N) -> List[SearchResult]:
+        """Attach extracted page text to the top-scored results."""
+        ranked = sorted(range(len(results)), key=lambda i: results[i].score, reverse=True)[:top_n]
+        texts = await asyncio.gather(*[self.fetch_text(results[i].url) for i in ranked])
+        enriched = list(results)
+        for i, text in zip(ranked, texts):
+            if text:
+                enriched[i] = replace(enriched[i], content=text)
+        return enriched
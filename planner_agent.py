@@ -3,6 +3,8 @@ from pydantic import Field
 from langchain_core.messages import SystemMessage, HumanMessage, AIMessage
 from llm_models import model_mini
 from state import WebSearchItem, WebSearchPlan, ResearchState
+from deadline import DeadlineExceeded, WRITER_RESERVE_SECONDS
+from budget import charged, budget_left, BudgetExceeded, SEARCH_TOKEN_ESTIMATE, WRITER_TOKEN_RESERVE
 
 HOW_MANY_SEARCHES = 3
 
@@ -13,18 +15,38 @@ For each search, provide:
 1. A clear reason why this search is important
 2. A specific, actionable search query
 
-Make sure the searches are comprehensive and cover different aspects of the topic.""".format(HOW_MANY_SEARCHES=HOW_MANY_SEARCHES)
+Make sure the searches are comprehensive and cover different aspects of the topic."""
+
+def affordable_searches(state: ResearchState) -> int:
+    """How many searches fit the job's token budget after keeping the writer's share (at least one)."""
+    left = budget_left(state, keep=WRITER_TOKEN_RESERVE)
+    if left is None:
+        return HOW_MANY_SEARCHES
+    return max(1, min(HOW_MANY_SEARCHES, int(left // SEARCH_TOKEN_ESTIMATE)))
 
 async def planner_node(state: ResearchState) -> dict:
     """PlannerAgent: Logic to generate the search plan."""
     print("Planning the searches...🤔")
     
-    # Create the planner with structured output
-    planner = model_mini.with_structured_output(WebSearchPlan)
-    response = await planner.ainvoke([
-        SystemMessage(content=PLANNER_INSTRUCTIONS),
-        HumanMessage(content=f"Query: {state['query']}")
-    ])
+    how_many = affordable_searches(state)
+    if how_many < HOW_MANY_SEARCHES:
+        print(f"💰 Token budget allows {how_many} of {HOW_MANY_SEARCHES} searches")
+    
+    # Create the planner with structured output; the raw message carries token usage
+    planner = model_mini.with_structured_output(WebSearchPlan, include_raw=True)
+    try:
+        result = await charged(planner, [
+            SystemMessage(content=PLANNER_INSTRUCTIONS.format(HOW_MANY_SEARCHES=how_many)),
+            HumanMessage(content=f"Query: {state['query']}")
+        ], state, output_tokens=300, keep=WRITER_TOKEN_RESERVE, reserve=WRITER_RESERVE_SECONDS)
+        if result["parsed"] is None:
+            raise result["parsing_error"] or ValueError("Planner returned no search plan")
+        response = result["parsed"]
+        response.searches = response.searches[:how_many]
+    except (DeadlineExceeded, BudgetExceeded) as e:
+        # Out of planning time or budget: search for the query as asked
+        print(f"⏰ {e} while planning, searching the query directly")
+        response = WebSearchPlan(searches=[WebSearchItem(reason="Planning skipped", query=state['query'])])
     
     print(f"Will search {len(response.searches)} searches 🔎")
     return {
@@ -1,4 +1,5 @@
 import os
+import asyncio
 import requests
 import logging
 import streamlit as st
@@ -6,6 +7,9 @@ from langchain_core.tools import tool
 from langchain_core.messages import SystemMessage, HumanMessage, AIMessage, ToolMessage
 from llm_models import model_mini
 from state import ReportData, ResearchState
+from side_store import resolve
+from deadline import bounded, DeadlineExceeded
+from budget import charged, BudgetExceeded
 
 
 # Set up logging
@@ -62,7 +66,7 @@ async def push_node(state: ResearchState) -> dict:
         pusher = model_mini.bind_tools([push_notification_tool])
         
         # Extract summary from report - handle both dict and ReportData
-        report = state.get("report")
+        report = resolve(state.get("report"))
         
         if report is None:
             summary = "Research completed. Full report available."
@@ -89,7 +93,13 @@ Full report is now available for review."""
             HumanMessage(content=f"Please send this notification: {notification_msg}")
         ]
 
-        res1 = await pusher.ainvoke(messages)
+        try:
+            res1 = await charged(pusher, messages, state, output_tokens=200)
+        except BudgetExceeded:
+            # Out of tokens: send the prepared message without asking the model
+            print("💰 Token budget exhausted, sending notification directly")
+            out = await bounded(asyncio.to_thread(push_notification_tool.invoke, notification_msg), state)
+            return {"messages": [AIMessage(content=f"Notification sent without model: {out}")]}
         logger.info(f"Push agent response: {res1}")
         
         messages.append(res1)
@@ -109,15 +119,19 @@ Full report is now available for review."""
                             args['message'] = notification_msg
                         
                         logger.info(f"Calling push_notification_tool with: {args}")
-                        out = push_notification_tool.invoke(args['message'])
+                        # requests.post blocks, so keep it off the event loop
+                        out = await bounded(asyncio.to_thread(push_notification_tool.invoke, args['message']), state)
                         
                         messages.append(ToolMessage(
                             content=str(out),
                             tool_call_id=tc['id']
                         ))
                         
-                        # Get confirmation
-                        res2 = await pusher.ainvoke(messages)
+                        # Get confirmation; the notification is already out, so skip it when over budget
+                        try:
+                            res2 = await charged(pusher, messages, state, output_tokens=100)
+                        except BudgetExceeded:
+                            pass
                         print("✅ Push notification completed")
                         return {"messages": [AIMessage(content="Notification sent and confirmed.")]}
                         
@@ -128,6 +142,10 @@ Full report is now available for review."""
         # If no tool was called
         print("⚠️ No notification sent (tool not called)")
         return {"messages": [AIMessage(content="Notification step completed (no call).")]}
+    
+    except DeadlineExceeded:
+        print("⏰ Deadline reached, skipping notification")
+        return {"messages": [AIMessage(content="Notification skipped at deadline.")]}
         
     except Exception as e:
         error_msg = f"Error in push_node: {e}"
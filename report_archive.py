@@ -0,0 +1,205 @@
+"""
+Persistent archive of finished research reports.
+
+Each report is stored once, zlib-compressed and content-addressed by the
+SHA-256 of its contents, together with its query, sources and timestamps.
+An SQLite FTS5 index over query, summary and report body makes the archive
+searchable, and listings are paged with a created_at cursor so front ends
+never load more than one page.
+
+Reports are archived by whichever process runs the job. With a worker fleet,
+point REPORT_ARCHIVE_DIR on the workers and the front end at the same shared
+volume (one whose file locks work, as SQLite requires); otherwise each worker
+archives to its own disk and the front end's browser, reuse and exports
+never see those reports.
+"""
+import os
+import json
+import time
+import zlib
+import sqlite3
+import hashlib
+import logging
+import threading
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+from state import ReportData, SearchResult
+from document_store import tokenize
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_DIR_SHARED = "REPORT_ARCHIVE_DIR" in os.environ
+ARCHIVE_DIR = os.getenv("REPORT_ARCHIVE_DIR", os.path.join(".research_store", "reports"))
+ARCHIVE_ENABLED = os.getenv("REPORT_ARCHIVE_ENABLED", "1") == "1"
+# An archived report is offered for a new query when it is this fresh and this similar
+ARCHIVE_MAX_AGE_HOURS = float(os.getenv("ARCHIVE_MAX_AGE_HOURS", "24"))
+ARCHIVE_MIN_SIMILARITY = float(os.getenv("ARCHIVE_MIN_SIMILARITY", "0.8"))
+PAGE_SIZE = 20
+
+@dataclass(slots=True, frozen=True)
+class ArchivedReport:
+    """Listing entry for an archived report; the body is loaded separately with ReportArchive.load."""
+    report_id: str
+    query: str
+    short_summary: str
+    created_at: float
+    source_count: int
+
+def _query_similarity(a: str, b: str) -> float:
+    """Jaccard similarity of the two queries' token sets."""
+    ta, tb = set(tokenize(a)), set(tokenize(b))
+    if not ta or not tb:
+        return 0.0
+    return len(ta & tb) / len(ta | tb)
+
+def _fts_query(text: str) -> str:
+    # Quote every token so user input can never be parsed as FTS syntax
+    return " OR ".join(f'"{token}"' for token in dict.fromkeys(tokenize(text)))
+
+class ReportArchive:
+    """Content-addressed, compressed report store with a full-text index."""
+
+    def __init__(self, directory: str = ARCHIVE_DIR):
+        self.directory = directory
+        self.objects_dir = os.path.join(directory, "objects")
+        os.makedirs(self.objects_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(directory, "index.sqlite3"), check_same_thread=False)
+        self._db.executescript("""
+            PRAGMA journal_mode=WAL;
+            CREATE TABLE IF NOT EXISTS reports (
+                rowid INTEGER PRIMARY KEY,
+                report_id TEXT UNIQUE NOT NULL,
+                query TEXT NOT NULL,
+                short_summary TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                source_count INTEGER NOT NULL,
+                stored_bytes INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS reports_created ON reports(created_at);
+            CREATE VIRTUAL TABLE IF NOT EXISTS reports_fts USING fts5(
+                query, short_summary, body, content=''
+            );
+        """)
+
+    def _object_path(self, report_id: str) -> str:
+        return os.path.join(self.objects_dir, report_id[:2], f"{report_id}.json.z")
+
+    # ------------------------------------------------------------------
+    # Writes
+    # ------------------------------------------------------------------
+    def save(self, query: str, report: ReportData, sources: List[SearchResult]) -> str:
+        """Archive a report and return its content id. Saving identical content again only refreshes it."""
+        payload = {
+            "query": query,
+            "report": report.model_dump(),
+            "sources": [s.to_dict() for s in sources],
+        }
+        blob = json.dumps(payload, sort_keys=True, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        report_id = hashlib.sha256(blob).hexdigest()
+        now = time.time()
+
+        path = self._object_path(report_id)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.{os.getpid()}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(zlib.compress(blob, 6))
+            os.replace(tmp, path)
+
+        with self._lock:
+            existing = self._db.execute("SELECT rowid FROM reports WHERE report_id = ?", (report_id,)).fetchone()
+            if existing:
+                self._db.execute("UPDATE reports SET created_at = ? WHERE rowid = ?", (now, existing[0]))
+            else:
+                rowid = self._db.execute(
+                    "INSERT INTO reports (report_id, query, short_summary, created_at, source_count, stored_bytes) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (report_id, query, report.short_summary, now, len(sources), os.path.getsize(path)),
+                ).lastrowid
+                self._db.execute(
+                    "INSERT INTO reports_fts (rowid, query, short_summary, body) VALUES (?, ?, ?, ?)",
+                    (rowid, query, report.short_summary, report.markdown_report),
+                )
+            self._db.commit()
+        print(f"🗄️ Archived report {report_id[:12]} ({len(blob)} -> {os.path.getsize(path)} bytes)")
+        return report_id
+
+    # ------------------------------------------------------------------
+    # Reads
+    # ------------------------------------------------------------------
+    def load(self, report_id: str) -> Tuple[str, ReportData, List[SearchResult]]:
+        """Return (query, report, sources) for an archived report."""
+        with open(self._object_path(report_id), "rb") as f:
+            payload = json.loads(zlib.decompress(f.read()))
+        return (
+            payload["query"],
+            ReportData(**payload["report"]),
+            [SearchResult.from_dict(s) for s in payload.get("sources", [])],
+        )
+
+    def _entries(self, sql: str, params: tuple) -> List[ArchivedReport]:
+        with self._lock:
+            rows = self._db.execute(sql, params).fetchall()
+        return [ArchivedReport(*row) for row in rows]
+
+    def list_reports(self, before: Optional[float] = None, limit: int = PAGE_SIZE) -> List[ArchivedReport]:
+        """Newest-first page of reports. Pass the last entry's created_at as `before` for the next page."""
+        return self._entries(
+            "SELECT report_id, query, short_summary, created_at, source_count FROM reports "
+            "WHERE created_at < ? ORDER BY created_at DESC LIMIT ?",
+            (before if before is not None else float("inf"), limit),
+        )
+
+    def search(self, text: str, limit: int = PAGE_SIZE, offset: int = 0) -> List[ArchivedReport]:
+        """Full-text search over query, summary and report body, best matches first."""
+        match = _fts_query(text)
+        if not match:
+            return []
+        return self._entries(
+            "SELECT r.report_id, r.query, r.short_summary, r.created_at, r.source_count "
+            "FROM reports_fts JOIN reports r ON r.rowid = reports_fts.rowid "
+            "WHERE reports_fts MATCH ? ORDER BY bm25(reports_fts, 10.0, 3.0, 1.0) LIMIT ? OFFSET ?",
+            (match, limit, offset),
+        )
+
+    def find_fresh(self, query: str, max_age_hours: float = ARCHIVE_MAX_AGE_HOURS) -> Optional[ArchivedReport]:
+        """Most similar recent report for essentially the same query, if any."""
+        cutoff = time.time() - max_age_hours * 3600
+        match = _fts_query(query)
+        if not match:
+            return None
+        candidates = self._entries(
+            "SELECT r.report_id, r.query, r.short_summary, r.created_at, r.source_count "
+            "FROM reports_fts JOIN reports r ON r.rowid = reports_fts.rowid "
+            "WHERE reports_fts.query MATCH ? AND r.created_at >= ? "
+            "ORDER BY bm25(reports_fts) LIMIT 10",
+            (match, cutoff),
+        )
+        scored = [(_query_similarity(query, c.query), c) for c in candidates]
+        scored = [(score, c) for score, c in scored if score >= ARCHIVE_MIN_SIMILARITY]
+        if not scored:
+            return None
+        return max(scored, key=lambda sc: (sc[0], sc[1].created_at))[1]
+
+    def count(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM reports").fetchone()[0]
+
+_archive: Optional[ReportArchive] = None
+_archive_lock = threading.Lock()
+
+def get_report_archive() -> Optional[ReportArchive]:
+    """Shared archive for this process, or None when disabled or unavailable."""
+    global _archive
+    if not ARCHIVE_ENABLED:
+        return None
+    with _archive_lock:
+        if _archive is None:
+            try:
+                _archive = ReportArchive()
+            except Exception as e:
+                logger.error(f"Report archive unavailable: {e}")
+                return None
+        return _archive
@@ -0,0 +1,272 @@
+"""
+Report export: render finished reports to HTML, PDF and DOCX off the request path.
+
+Rendering runs in a small process pool (started with spawn and at lowered CPU
+priority), so a burst of exports neither blocks the UI process nor competes
+with research jobs for the event loop. Artifacts are cached on disk under the
+SHA-256 of the report contents and format; concurrent requests for the same
+artifact share one in-flight render. Finished files are served from disk, so
+front ends can stream them instead of holding them in memory.
+"""
+import os
+import re
+import json
+import html
+import asyncio
+import hashlib
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Optional
+
+from state import ReportData
+from disk_cache import evict_lru
+
+logger = logging.getLogger(__name__)
+
+EXPORT_DIR = os.getenv("REPORT_EXPORT_DIR", os.path.join(".research_store", "exports"))
+EXPORT_WORKERS = int(os.getenv("EXPORT_WORKERS", "2"))
+# Cached artifacts beyond this size are evicted, least recently used first
+EXPORT_CACHE_MAX_MB = float(os.getenv("EXPORT_CACHE_MAX_MB", "500"))
+# Optional TTF font for PDFs; without one, text outside Latin-1 is approximated
+EXPORT_PDF_FONT = os.getenv("EXPORT_PDF_FONT", "")
+EXPORT_NICENESS = 10
+
+# format -> (file extension, MIME type)
+FORMATS = {
+    "html": ("html", "text/html"),
+    "pdf": ("pdf", "application/pdf"),
+    "docx": ("docx", "application/vnd.openxmlformats-officedocument.wordprocessingml.document"),
+}
+
+HTML_TEMPLATE = """<!DOCTYPE html>
+<html lang="en">
+<head>
+<meta charset="utf-8">
+<title>{title}</title>
+<style>
+body {{ max-width: 50rem; margin: 2rem auto; padding: 0 1rem; font-family: system-ui, sans-serif; line-height: 1.6; color: #222; }}
+pre, code {{ background: #f4f4f4; border-radius: 4px; }}
+pre {{ padding: 0.75rem; overflow-x: auto; }}
+table {{ border-collapse: collapse; }}
+th, td {{ border: 1px solid #ccc; padding: 0.3rem 0.6rem; }}
+.summary {{ font-style: italic; color: #555; }}
+</style>
+</head>
+<body>
+{body}
+</body>
+</html>
+"""
+
+# Typographic characters the PDF core fonts cannot encode
+_LATIN1_FALLBACKS = str.maketrans({
+    "‘": "'", "’": "'", "“": '"', "”": '"', "–": "-", "—": "-",
+    "…": "...", "•": "*", " ": " ", "→": "->",
+})
+
+def report_hash(report: ReportData, query: str) -> str:
+    """SHA-256 of the report contents and query, the cache key for its artifacts."""
+    payload = {"query": query, "report": report.model_dump()}
+    blob = json.dumps(payload, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+def _slug(text: str) -> str:
+    return re.sub(r"[^a-z0-9]+", "-", text.lower()).strip("-")[:60] or "report"
+
+# ----------------------------------------------------------------------
+# Renderers (run in the worker processes)
+# ----------------------------------------------------------------------
+def _markdown_parser():
+    from markdown_it import MarkdownIt
+    # Raw HTML in model output is escaped, not passed through
+    return MarkdownIt("commonmark", {"html": False}).enable("table")
+
+def _report_html(query: str, report: dict) -> str:
+    parser = _markdown_parser()
+    follow_ups = "".join(f"<li>{html.escape(q)}</li>" for q in report["follow_up_questions"])
+    return (
+        f"<h1>{html.escape(query)}</h1>\n"
+        f"<p class=\"summary\">{html.escape(report['short_summary'])}</p>\n"
+        f"{parser.render(report['markdown_report'])}\n"
+        f"<h2>Follow-up Questions</h2>\n<ul>{follow_ups}</ul>\n"
+    )
+
+def _render_html(query: str, report: dict, path: str) -> None:
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(HTML_TEMPLATE.format(title=html.escape(query), body=_report_html(query, report)))
+
+def _render_pdf(query: str, report: dict, path: str) -> None:
+    from fpdf import FPDF
+
+    pdf = FPDF()
+    pdf.set_auto_page_break(auto=True, margin=15)
+    pdf.add_page()
+    body = _report_html(query, report)
+    if EXPORT_PDF_FONT:
+        pdf.add_font("Report", fname=EXPORT_PDF_FONT)
+        pdf.set_font("Report", size=11)
+    else:
+        pdf.set_font("Helvetica", size=11)
+        body = body.translate(_LATIN1_FALLBACKS).encode("latin-1", "replace").decode("latin-1")
+    pdf.write_html(body)
+    pdf.output(path)
+
+def _add_inline(paragraph, children) -> None:
+    """Add markdown-it inline tokens to a DOCX paragraph as formatted runs."""
+    bold = italic = False
+    for child in children or []:
+        if child.type == "strong_open":
+            bold = True
+        elif child.type == "strong_close":
+            bold = False
+        elif child.type == "em_open":
+            italic = True
+        elif child.type == "em_close":
+            italic = False
+        elif child.type in ("softbreak", "hardbreak"):
+            paragraph.add_run("\n" if child.type == "hardbreak" else " ")
+        elif child.type in ("text", "code_inline"):
+            run = paragraph.add_run(child.content)
+            run.bold, run.italic = bold, italic
+            if child.type == "code_inline":
+                run.font.name = "Courier New"
+
+def _render_docx(query: str, report: dict, path: str) -> None:
+    from docx import Document
+
+    doc = Document()
+    doc.add_heading(query, level=0)
+    doc.add_paragraph().add_run(report["short_summary"]).italic = True
+
+    heading_style = None
+    list_styles = []
+    for token in _markdown_parser().parse(report["markdown_report"]):
+        if token.type == "heading_open":
+            heading_style = f"Heading {min(int(token.tag[1:]), 4)}"
+        elif token.type == "bullet_list_open":
+            list_styles.append("List Bullet")
+        elif token.type == "ordered_list_open":
+            list_styles.append("List Number")
+        elif token.type in ("bullet_list_close", "ordered_list_close"):
+            list_styles.pop()
+        elif token.type == "inline":
+            style = heading_style or (list_styles[-1] if list_styles else None)
+            _add_inline(doc.add_paragraph(style=style), token.children)
+            heading_style = None
+        elif token.type in ("fence", "code_block"):
+            doc.add_paragraph().add_run(token.content.rstrip()).font.name = "Courier New"
+
+    doc.add_heading("Follow-up Questions", level=2)
+    for question in report["follow_up_questions"]:
+        doc.add_paragraph(question, style="List Bullet")
+    doc.save(path)
+
+_RENDERERS = {"html": _render_html, "pdf": _render_pdf, "docx": _render_docx}
+
+def _render(fmt: str, query: str, report: dict, path: str) -> str:
+    """Render one artifact. Writes to a temporary file first so readers never see a partial one."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    try:
+        _RENDERERS[fmt](query, report, tmp)
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return path
+
+def _init_worker() -> None:
+    # Exports can wait; research jobs on the same machine should not
+    try:
+        os.nice(EXPORT_NICENESS)
+    except (AttributeError, OSError):
+        pass
+
+# ----------------------------------------------------------------------
+# Exporter (runs in the UI process)
+# ----------------------------------------------------------------------
+class ReportExporter:
+    """Renders reports in a process pool, caching artifacts and sharing in-flight renders."""
+
+    def __init__(self, directory: str = EXPORT_DIR, workers: int = EXPORT_WORKERS):
+        self.directory = directory
+        self.workers = workers
+        os.makedirs(directory, exist_ok=True)
+        # Re-entrant: a done callback can run inline while submit still holds the lock
+        self._lock = threading.RLock()
+        self._inflight: Dict[str, Future] = {}
+        self._pool = self._new_pool()
+
+    def _new_pool(self) -> ProcessPoolExecutor:
+        # spawn, so workers never inherit the UI process's threads and locks
+        return ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+        )
+
+    def artifact_path(self, report: ReportData, query: str, fmt: str) -> str:
+        key = report_hash(report, query)
+        return os.path.join(self.directory, key[:2], key, f"{_slug(query)}.{FORMATS[fmt][0]}")
+
+    def export(self, report: ReportData, query: str, fmt: str) -> "Future[str]":
+        """Future resolving to the path of the rendered artifact."""
+        if fmt not in FORMATS:
+            raise ValueError(f"Unsupported export format: {fmt}")
+        path = self.artifact_path(report, query, fmt)
+
+        with self._lock:
+            if os.path.exists(path):
+                os.utime(path)
+                future = Future()
+                future.set_result(path)
+                return future
+
+            future = self._inflight.get(path)
+            if future is not None:
+                return future
+
+            print(f"📦 Rendering {fmt.upper()} export for: {query}")
+            try:
+                future = self._pool.submit(_render, fmt, query, report.model_dump(), path)
+            except BrokenProcessPool:
+                # A worker died (e.g. killed for memory); start a fresh pool and retry once
+                self._pool = self._new_pool()
+                future = self._pool.submit(_render, fmt, query, report.model_dump(), path)
+            self._inflight[path] = future
+            future.add_done_callback(lambda f: self._finished(path, fmt, f))
+            return future
+
+    async def aexport(self, report: ReportData, query: str, fmt: str) -> str:
+        """Await an export from async code without blocking the event loop."""
+        return await asyncio.wrap_future(self.export(report, query, fmt))
+
+    def _finished(self, path: str, fmt: str, future: Future) -> None:
+        with self._lock:
+            self._inflight.pop(path, None)
+        if future.cancelled():
+            return
+        error = future.exception()
+        if error is not None:
+            logger.error(f"Export to {fmt} failed: {error}")
+            return
+        print(f"📦 Export ready: {future.result()}")
+        self._prune()
+
+    def _prune(self) -> None:
+        """Evict least recently used artifacts while the cache is over EXPORT_CACHE_MAX_MB."""
+        evict_lru(self.directory, EXPORT_CACHE_MAX_MB * 1024 * 1024)
+
+_exporter: Optional[ReportExporter] = None
+_exporter_lock = threading.Lock()
+
+def get_report_exporter() -> ReportExporter:
+    """Shared exporter for this process; the worker pool starts on first export."""
+    global _exporter
+    with _exporter_lock:
+        if _exporter is None:
+            _exporter = ReportExporter()
+        return _exporter
@@ -1,18 +1,30 @@
+import uuid
 import asyncio
+import threading
 import traceback
-from typing import Generator
+from typing import Generator, Optional
 from langchain_core.messages import HumanMessage
 from langgraph.graph import StateGraph, START, END
 from langgraph.checkpoint.memory import MemorySaver
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
 
 # Import modules
 from llm_models import model_mini, model_large
-from state import ResearchState, ReportData
+from datetime import datetime
+from state import ResearchState, ReportData, ReportReady, WebSearchItem, SearchResult, SearchFinding, dedupe_results
+from side_store import BlobRef, resolve, side_store
+from deadline import new_deadline
+from budget import get_budget_ledger, DEFAULT_TENANT
+from diagnostics import begin_job, end_job
+from report_archive import get_report_archive, ARCHIVE_DIR_SHARED
 from planner_agent import planner_node
 from search_agent import search_node
 from writer_agent import writer_node
 from push_agent import push_node
 
+# Non-builtin types stored in ResearchState, allowed when checkpoints are deserialized
+CHECKPOINT_TYPES = (WebSearchItem, ReportData, SearchResult, SearchFinding, BlobRef)
+
 class ResearchManager:
     """Manages the research workflow."""
     
@@ -38,8 +50,10 @@ class ResearchManager:
             self.builder.add_edge("notifier", END)
             
             # Compile graph
-            memory = MemorySaver()
-            self.graph = self.builder.compile(checkpointer=memory)
+            # Our state types are registered so checkpoints restore them without warnings
+            self.memory = MemorySaver(serde=JsonPlusSerializer(allowed_msgpack_modules=CHECKPOINT_TYPES))
+            self.graph = self.builder.compile(checkpointer=self.memory)
+            self.archive = get_report_archive()
             
             print("✅ Research Manager initialized successfully")
             
@@ -48,17 +62,57 @@ class ResearchManager:
             traceback.print_exc()
             raise
     
-    async def run(self, user_query: str) -> Generator[str, None, None]:
-        """Run the research workflow with clean output."""
+    async def run(
+        self, user_query: str, deadline_seconds: Optional[float] = None, profile: bool = False,
+        reuse_archive: bool = True, tenant: str = DEFAULT_TENANT, token_budget: Optional[float] = None,
+        job_id: Optional[str] = None
+    ) -> Generator[str, None, None]:
+        """Run the research workflow with clean output.
+
+        The job is bounded by `deadline_seconds` (JOB_DEADLINE_SECONDS by default).
+        Closing or cancelling the generator cancels all in-flight model and search calls.
+        With diagnostics on, `profile=True` writes a flamegraph-ready profile of the job;
+        so does diagnostics.request_profile(job_id) while it runs. `job_id` is a new ID by default.
+        With `reuse_archive`, a fresh archived report for the same query is served instead.
+        Model calls are charged to `token_budget` (JOB_TOKEN_BUDGET by default) and to
+        `tenant`'s daily budget; the job degrades rather than fails as they run low.
+        A finished report is followed by a ReportReady marker carrying it.
+        """
+        if reuse_archive and self.archive is not None:
+            match = await asyncio.to_thread(self.archive.find_fresh, user_query)
+            if match is not None:
+                _, report, _ = await asyncio.to_thread(self.archive.load, match.report_id)
+                created = datetime.fromtimestamp(match.created_at).strftime("%Y-%m-%d %H:%M")
+                print(f"🗄️ Serving archived report {match.report_id[:12]} for: {user_query}")
+                yield (f"## 🗄️ Archived Report\n\nA report for *{match.query}* from {created} was found in the "
+                       "archive and is shown below. Request fresh research to run the query again.\n\n")
+                for chunk in report_chunks(report, user_query):
+                    yield chunk
+                yield ReportReady(match.query, report, match.report_id)
+                return
+        
+        ledger = get_budget_ledger()
+        await ledger.arefresh_tenant(tenant)
+        if ledger.tenant_left(tenant) <= 0:
+            print(f"💰 Tenant {tenant} has used its daily token budget, refusing: {user_query}")
+            yield "## ❌ Daily Token Budget Reached\n\nThe daily research budget has been used up. Please try again tomorrow."
+            return
+        
         print(f"\n{'='*60}")
         print(f"📋 STARTING RESEARCH: {user_query}")
         print(f"{'='*60}\n")
         
+        job_id = job_id or uuid.uuid4().hex
         inputs = {
+            "job_id": job_id,
+            "deadline": new_deadline(deadline_seconds),
             "query": user_query,
             "messages": [HumanMessage(content=user_query)]
         }
-        config = {"configurable": {"thread_id": f"user_{hash(user_query) % 10000}"}}
+        config = {"configurable": {"thread_id": f"job_{job_id}"}}
+        print(f"🆔 Job ID: {job_id}")
+        diagnostics_token = begin_job(job_id, profile=profile)
+        ledger.open_job(job_id, tenant, token_budget)
         
         try:
             # Track node execution
@@ -92,7 +146,7 @@ class ResearchManager:
             
             # Extract report
             if "report" in final_state.values:
-                report = final_state.values["report"]
+                report = resolve(final_state.values["report"])
                 
                 # Ensure report is ReportData object, not dict/JSON
                 if isinstance(report, dict):
@@ -112,16 +166,22 @@ class ResearchManager:
                 print(f"❓ Follow-up questions: {len(report.follow_up_questions)}")
                 print(f"{'='*60}\n")
                 
-                # Yield final report - ONLY markdown, no JSON
-                yield f"## 📋 Final Research Report\n\n"
-                yield str(report.markdown_report) + "\n\n"
-                yield "## ❓ Follow-up Questions\n\n"
-                for q in report.follow_up_questions:
-                    yield f"- {q}\n"
+                # Partial or degraded reports are not worth serving again
+                degraded = final_state.values.get("partial_report") or final_state.values.get("degraded_report")
+                report_id = ""
+                if self.archive is not None and not degraded:
+                    findings = resolve(final_state.values.get("search_results", []))
+                    sources = dedupe_results(s for f in findings for s in f.sources)
+                    try:
+                        report_id = await asyncio.to_thread(self.archive.save, user_query, report, sources)
+                    except Exception as e:
+                        print(f"⚠️ Could not archive report: {e}")
+                elif self.archive is not None:
+                    print("🗄️ Report is partial or degraded, not archiving it")
                 
-                yield f"\n\n---\n**✅ Research completed successfully!**\n"
-                yield f"**Query:** {user_query}\n"
-                yield f"**Summary:** {report.short_summary[:150]}...\n"
+                for chunk in report_chunks(report, user_query):
+                    yield chunk
+                yield ReportReady(user_query, report, report_id)
                 
             else:
                 error_msg = "❌ Error: Report not generated in final state"
@@ -140,6 +200,51 @@ class ResearchManager:
             yield f"## ❌ Research Failed\n\n"
             yield f"**Error:** {str(e)[:200]}\n\n"
             yield "Please check your API keys and try again."
+        
+        finally:
+            end_job(job_id, diagnostics_token)
+            spend = ledger.close_job(job_id)
+            if spend is not None:
+                print(f"💰 Job used {spend.spent:.0f} of {spend.limit:.0f} budget tokens "
+                      f"({spend.tokens} tokens in {spend.calls} model calls)")
+            # Nothing reads a finished job's state again, so keep per-job memory from piling up
+            side_store.release(job_id)
+            self.memory.delete_thread(config["configurable"]["thread_id"])
+
+def report_chunks(report: ReportData, user_query: str) -> Generator[str, None, None]:
+    """Render a finished report as the markdown chunks the front ends display."""
+    # Yield final report - ONLY markdown, no JSON
+    yield f"## 📋 Final Research Report\n\n"
+    yield str(report.markdown_report) + "\n\n"
+    yield "## ❓ Follow-up Questions\n\n"
+    for q in report.follow_up_questions:
+        yield f"- {q}\n"
+    
+    yield f"\n\n---\n**✅ Research completed successfully!**\n"
+    yield f"**Query:** {user_query}\n"
+    yield f"**Summary:** {report.short_summary[:150]}...\n"
+
+def create_research_manager():
+    """Build the manager the front ends should use.
+
+    With RESEARCH_QUEUE_URL set, jobs are sent to the worker fleet instead of
+    running in this process. memory:// keeps the queue and one worker in-process,
+    which exercises the queued path without any external service.
+    """
+    from job_queue import QUEUE_URL, QueuedResearchManager, create_job_queue
+
+    if not QUEUE_URL:
+        return ResearchManager()
+
+    queue = create_job_queue(QUEUE_URL)
+    if QUEUE_URL.startswith("memory://"):
+        from worker import ResearchWorker
+        worker = ResearchWorker(queue, manager=ResearchManager())
+        threading.Thread(target=asyncio.run, args=(worker.run(),), daemon=True, name="research-worker").start()
+    elif not ARCHIVE_DIR_SHARED:
+        print("⚠️ REPORT_ARCHIVE_DIR is not set: reports archived by remote workers will not appear here")
+    print(f"📮 Research jobs will run on workers via {QUEUE_URL.split('@')[-1]}")
+    return QueuedResearchManager(queue)
 
 # For direct testing
 if __name__ == "__main__":
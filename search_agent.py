@@ -2,13 +2,20 @@
 Search agent for executing web searches and summarizing results.
 """
 import asyncio
+import contextlib
+from dataclasses import replace
 from typing import List
 import logging
 from langchain_core.messages import SystemMessage, HumanMessage, AIMessage, ToolMessage
 from langchain_core.tools import tool
 from langchain_community.tools.tavily_search import TavilySearchResults
 from llm_models import model_mini
-from state import WebSearchItem, ResearchState
+from state import WebSearchItem, ResearchState, SearchResult, SearchFinding, format_results
+from document_store import get_document_store
+from page_fetcher import PageFetcher, DEEP_FETCH_ENABLED
+from side_store import stash
+from deadline import bounded, time_left, DeadlineExceeded, WRITER_RESERVE_SECONDS
+from budget import charged, budget_left, BudgetExceeded, SEARCH_TOKEN_ESTIMATE, WRITER_TOKEN_RESERVE
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
@@ -29,6 +36,20 @@ Focus on:
 4. Comparisons and differentiations
 5. Recent developments"""
 
+# Web searches one planned search may run, however many the model asks for
+MAX_TOOL_CALLS_PER_SEARCH = 2
+# Output allowance for a search summary (under 300 words)
+SUMMARY_TOKENS = 500
+
+def run_web_search(query: str) -> List[SearchResult]:
+    """Run a Tavily search and return typed result records."""
+    print(f"🔍 Searching for: {query}")
+    search = TavilySearchResults(max_results=3)
+    raw = search.invoke({"query": query})  # Pass as dictionary
+    if not isinstance(raw, list):
+        raise ValueError(f"Unexpected search response: {str(raw)[:200]}")
+    return [SearchResult.from_tavily(item) for item in raw if isinstance(item, dict)]
+
 @tool
 def web_search_tool(query: str) -> str:
     """Search the web for the given term. Use this for research.
@@ -37,10 +58,7 @@ def web_search_tool(query: str) -> str:
         query: The search term to look up.
     """
     try:
-        print(f"🔍 Searching for: {query}")
-        search = TavilySearchResults(max_results=3)
-        result = search.invoke({"query": query})  # Pass as dictionary
-        return str(result)
+        return format_results(run_web_search(query))
     except Exception as e:
         error_msg = f"Error performing search for '{query}': {e}"
         print(f"❌ {error_msg}")
@@ -53,11 +71,29 @@ async def search_node(state: ResearchState) -> dict:
     try:
         # Bind the tool to the model
         search_agent = model_mini.bind_tools([web_search_tool])
+        store = get_document_store()
+        fetcher = PageFetcher() if DEEP_FETCH_ENABLED else None
         
-        async def perform_single_search(item: WebSearchItem) -> str:
+        async def perform_single_search(item: WebSearchItem) -> SearchFinding:
             try:
                 print(f"  Starting search: '{item.query}'")
                 
+                # Answer from previously harvested sources when they cover the search
+                local = await asyncio.to_thread(store.answer_locally, item.query) if store else None
+                if local:
+                    print(f"  📚 Answered from local store: '{item.query}'")
+                    try:
+                        res = await charged(model_mini, [
+                            SystemMessage(content=SEARCH_INSTRUCTIONS),
+                            HumanMessage(content=f"Summarize these stored search results about: {item.query}\nReason for this search: {item.reason}\n\n{format_results(local, include_content=True)}")
+                        ], state, output_tokens=SUMMARY_TOKENS, keep=WRITER_TOKEN_RESERVE, reserve=WRITER_RESERVE_SECONDS)
+                        summary = res.content
+                    except (DeadlineExceeded, BudgetExceeded):
+                        summary = format_results(local)
+                    # Stored page text only goes to the summarizer, like freshly fetched pages
+                    sources = [replace(r, content="") for r in local]
+                    return SearchFinding(query=item.query, reason=item.reason, summary=summary, sources=sources)
+                
                 # Create initial message
                 initial_msg = [
                     SystemMessage(content=SEARCH_INSTRUCTIONS),
@@ -65,80 +101,145 @@ async def search_node(state: ResearchState) -> dict:
                 ]
                 
                 # Get initial response
-                res1 = await search_agent.ainvoke(initial_msg)
+                try:
+                    res1 = await charged(
+                        search_agent, initial_msg, state, output_tokens=200,
+                        keep=WRITER_TOKEN_RESERVE, reserve=WRITER_RESERVE_SECONDS
+                    )
+                except BudgetExceeded:
+                    # No budget left for the model: run the planned query as is and keep the raw results
+                    print(f"  💰 Budget exhausted, searching '{item.query}' without summarizing")
+                    found = await bounded(
+                        asyncio.to_thread(run_web_search, item.query), state, reserve=WRITER_RESERVE_SECONDS
+                    )
+                    return SearchFinding(query=item.query, reason=item.reason, summary=format_results(found), sources=found)
                 logger.info(f"Initial response: {res1}")
                 
                 messages = list(initial_msg) + [res1]
                 summary = ""
+                sources: List[SearchResult] = []
 
                 # Handle tool calls
                 if hasattr(res1, 'tool_calls') and res1.tool_calls:
                     print(f"  Tool calls detected: {res1.tool_calls}")
                     
-                    for tc in res1.tool_calls:
-                        if tc['name'] == 'web_search_tool':
-                            try:
-                                # Ensure query parameter exists
-                                args = tc.get('args', {})
-                                if not isinstance(args, dict):
-                                    args = {"query": str(args)}
-                                
-                                # Add query if missing
-                                if 'query' not in args:
-                                    args['query'] = item.query
-                                
-                                logger.info(f"Calling web_search_tool with args: {args}")
-                                out = web_search_tool.invoke(args)
-                                
-                                messages.append(ToolMessage(
-                                    content=str(out),
-                                    tool_call_id=tc['id']
-                                ))
-                                
-                                # Get summary from model
-                                res2 = await search_agent.ainvoke(messages)
-                                summary = res2.content
-                                
-                            except Exception as e:
-                                logger.error(f"Error in tool execution: {e}")
-                                summary = f"Error searching for {item.query}: {e}"
+                    # Short on budget: one search and no summary call
+                    left = budget_left(state, keep=WRITER_TOKEN_RESERVE)
+                    lean = left is not None and left < SEARCH_TOKEN_ESTIMATE
+                    max_calls = 1 if lean else MAX_TOOL_CALLS_PER_SEARCH
+                    if lean:
+                        print(f"  💰 Budget low, keeping search '{item.query}' lean")
+                    
+                    try:
+                        searched = 0
+                        for tc in res1.tool_calls:
+                            if tc['name'] != 'web_search_tool' or searched >= max_calls:
+                                # Every tool call needs an answer for the follow-up call to be valid
+                                messages.append(ToolMessage(content="Skipped: search limit reached.", tool_call_id=tc['id']))
+                                continue
+                            searched += 1
+                            
+                            # Ensure query parameter exists
+                            args = tc.get('args', {})
+                            if not isinstance(args, dict):
+                                args = {"query": str(args)}
+                            
+                            # Add query if missing
+                            if 'query' not in args:
+                                args['query'] = item.query
+                            
+                            logger.info(f"Calling web_search_tool with args: {args}")
+                            found = await bounded(
+                                asyncio.to_thread(run_web_search, args['query']), state, reserve=WRITER_RESERVE_SECONDS
+                            )
+                            sources.extend(found)
+                            
+                            # Read the top pages in full when deep fetch is on
+                            if fetcher and found and not lean:
+                                found = await bounded(fetcher.enrich(found), state, reserve=WRITER_RESERVE_SECONDS)
+                            
+                            # Indexed after enriching, so pages read in full are stored with their text
+                            if store and found:
+                                try:
+                                    await asyncio.to_thread(store.add, found)
+                                except Exception as e:
+                                    logger.error(f"Could not index sources locally: {e}")
+                            
+                            # Page text only goes to the summarizer; the state keeps plain records
+                            messages.append(ToolMessage(
+                                content=format_results(found, include_content=True),
+                                tool_call_id=tc['id']
+                            ))
+                        
+                        if lean:
+                            summary = format_results(sources)
+                        else:
+                            # One summary over every search this item ran
+                            res2 = await charged(
+                                search_agent, messages, state, output_tokens=SUMMARY_TOKENS,
+                                keep=WRITER_TOKEN_RESERVE, reserve=WRITER_RESERVE_SECONDS
+                            )
+                            summary = res2.content
+                        
+                    except (DeadlineExceeded, BudgetExceeded) as e:
+                        # No time or budget to summarize: hand the writer the raw results
+                        print(f"  ⏰ {e} during search: '{item.query}'")
+                        if not sources:
+                            raise
+                        summary = format_results(sources)
+                    except Exception as e:
+                        logger.error(f"Error in tool execution: {e}")
+                        summary = f"Error searching for {item.query}: {e}"
                 else:
                     # If no tool calls, use the initial response
                     summary = res1.content
                 
-                # Format the result
-                result = f"""SEARCH: {item.query}
-REASON: {item.reason}
-SUMMARY: {summary if summary else 'No summary generated'}
-{'='*60}"""
-                
                 print(f"  ✓ Completed search: '{item.query}'")
-                return result
+                return SearchFinding(
+                    query=item.query,
+                    reason=item.reason,
+                    summary=summary if summary else 'No summary generated',
+                    sources=sources
+                )
                 
             except Exception as e:
                 error_msg = f"Error in search for '{item.query}': {e}"
                 print(f"  ❌ {error_msg}")
-                return error_msg
+                return SearchFinding(query=item.query, reason=item.reason, error=error_msg)
         
-        # Execute searches in parallel
-        results = await asyncio.gather(
-            *[perform_single_search(item) for item in state["search_plan"]],
-            return_exceptions=True
-        )
+        # Execute searches in parallel, stopping in time to leave the writer its share
+        tasks = []
+        try:
+            async with fetcher or contextlib.nullcontext():
+                # Created once the fetcher's client is open
+                tasks = [asyncio.create_task(perform_single_search(item)) for item in state["search_plan"]]
+                remaining = time_left(state, WRITER_RESERVE_SECONDS)
+                _, pending = await asyncio.wait(tasks, timeout=max(remaining, 0.0) if remaining is not None else None)
+                for task in pending:
+                    task.cancel()
+                await asyncio.gather(*pending, return_exceptions=True)
+        finally:
+            # Also runs when the job itself is cancelled, so no search outlives it
+            for task in tasks:
+                task.cancel()
         
         # Handle any exceptions
         processed_results = []
-        for i, result in enumerate(results):
-            if isinstance(result, Exception):
-                error_msg = f"Search {i+1} failed: {result}"
-                processed_results.append(error_msg)
+        for item, task in zip(state["search_plan"], tasks):
+            if task.cancelled():
+                error_msg = f"Search '{item.query}' did not finish before the deadline"
+                processed_results.append(SearchFinding(query=item.query, reason=item.reason, error=error_msg))
+                print(f"⏰ {error_msg}")
+            elif task.exception() is not None:
+                error_msg = f"Search '{item.query}' failed: {task.exception()}"
+                processed_results.append(SearchFinding(query=item.query, reason=item.reason, error=error_msg))
                 print(f"❌ {error_msg}")
             else:
-                processed_results.append(result)
+                processed_results.append(task.result())
         
         print("✅ Web research completed.")
         return {
-            "search_results": processed_results,
+            "search_results": stash(state.get("job_id", ""), processed_results),
             "messages": [AIMessage(content="Web research completed.")]
         }
         
@@ -146,6 +247,6 @@ SUMMARY: {summary if summary else 'No summary generated'}
         error_msg = f"Error in search_node: {e}"
         print(f"❌ {error_msg}")
         return {
-            "search_results": [f"Search error: {e}"],
+            "search_results": [SearchFinding(query=state.get("query", ""), error=f"Search error: {e}")],
             "messages": [AIMessage(content="Error in search phase.")]
         }
\ No newline at end of file
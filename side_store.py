@@ -0,0 +1,59 @@
+"""
+Side store for bulky research state.
+
+Large values (search findings, the final report) are kept here once and the
+graph state only carries a small BlobRef handle. Checkpoints then serialize the
+handle instead of the value on every step. Values live for the duration of a
+job and are dropped with release(job_id) when the job finishes.
+"""
+import os
+import uuid
+import threading
+from dataclasses import dataclass
+from typing import Any, Dict
+
+LEAN_STATE = os.getenv("LEAN_STATE", "1") == "1"
+
+@dataclass(slots=True, frozen=True)
+class BlobRef:
+    """Handle to a value held in the side store."""
+    job_id: str
+    handle: str
+
+class SideStore:
+    """Process-local, thread-safe value store grouped by job."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+
+    def put(self, job_id: str, value: Any) -> BlobRef:
+        ref = BlobRef(job_id=job_id, handle=uuid.uuid4().hex)
+        with self._lock:
+            self._jobs.setdefault(job_id, {})[ref.handle] = value
+        return ref
+
+    def get(self, ref: BlobRef) -> Any:
+        with self._lock:
+            try:
+                return self._jobs[ref.job_id][ref.handle]
+            except KeyError:
+                raise KeyError(f"Side-store value {ref.handle} for job {ref.job_id} is gone") from None
+
+    def release(self, job_id: str) -> None:
+        with self._lock:
+            self._jobs.pop(job_id, None)
+
+side_store = SideStore()
+
+def stash(job_id: str, value: Any) -> Any:
+    """Store a bulky value and return the reference to put in the state (or the value itself when lean state is off)."""
+    if not LEAN_STATE or not job_id:
+        return value
+    return side_store.put(job_id, value)
+
+def resolve(value: Any) -> Any:
+    """Return the value behind a reference; plain values pass through unchanged."""
+    if isinstance(value, BlobRef):
+        return side_store.get(value)
+    return value
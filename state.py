@@ -1,16 +1,29 @@
-from typing import List, Annotated
+import os
+import json
+import hashlib
+from dataclasses import dataclass, field
+from typing import List, Annotated, Dict, Any, Iterable, Union
 from typing_extensions import TypedDict
 from pydantic import BaseModel, Field
 from langchain_core.messages import BaseMessage
+from side_store import BlobRef
+
+# Messages kept in the state; 0 disables history, N keeps the last N messages
+MESSAGE_HISTORY_LIMIT = int(os.getenv("MESSAGE_HISTORY_LIMIT", "0"))
 
 # Function to handle message accumulation
 def add_messages(left: List[BaseMessage], right: List[BaseMessage]) -> List[BaseMessage]:
-    """Add messages to the state."""
+    """Add messages to the state, keeping at most MESSAGE_HISTORY_LIMIT of them."""
+    if MESSAGE_HISTORY_LIMIT <= 0:
+        return []
     if right is None:
         return left
     if left is None:
-        return right
-    return left + right
+        return right[-MESSAGE_HISTORY_LIMIT:]
+    keep = MESSAGE_HISTORY_LIMIT - len(right)
+    if keep <= 0:
+        return right[-MESSAGE_HISTORY_LIMIT:]
+    return left[-keep:] + right
 
 class WebSearchItem(BaseModel):
     reason: str = Field(description="Your reasoning for why this search is important to the query")
@@ -24,9 +37,132 @@ class ReportData(BaseModel):
     markdown_report: str = Field(description="The final report.")
     follow_up_questions: List[str] = Field(description="Suggested topics to research further.")
 
+class ReportReady(str):
+    """Yielded by ResearchManager.run once the report is final.
+
+    Renders as empty text, so front ends that only concatenate output ignore it;
+    the others take the report on screen from it (e.g. for exports).
+    """
+    query: str
+    report: ReportData
+    report_id: str  # archive ID, empty when the report was not archived
+
+    def __new__(cls, query: str, report: ReportData, report_id: str = ""):
+        marker = super().__new__(cls, "")
+        marker.query = query
+        marker.report = report
+        marker.report_id = report_id or ""
+        return marker
+
+    def __getnewargs__(self):
+        return (self.query, self.report, self.report_id)
+
+    def to_json(self) -> str:
+        return json.dumps({"query": self.query, "report": self.report.model_dump(), "report_id": self.report_id})
+
+    @classmethod
+    def from_json(cls, data: str) -> "ReportReady":
+        payload = json.loads(data)
+        return cls(payload["query"], ReportData(**payload["report"]), payload.get("report_id", ""))
+
+# Characters of a snippet kept in prompts and checkpoints
+SNIPPET_LIMIT = 600
+# Characters of fetched page text shown to the search summarizer
+PROMPT_CONTENT_LIMIT = 4000
+
+def content_hash(text: str) -> str:
+    """Short, stable fingerprint of a piece of text (whitespace-insensitive)."""
+    normalized = " ".join(text.split()).lower()
+    return hashlib.sha1(normalized.encode("utf-8")).hexdigest()[:16]
+
+@dataclass(slots=True, frozen=True)
+class SearchResult:
+    """A single web source returned by a search."""
+    url: str
+    title: str = ""
+    snippet: str = ""
+    score: float = 0.0
+    published: str = ""
+    content_hash: str = ""
+    content: str = ""  # full page text, only set by the deep-fetch stage
+
+    @classmethod
+    def from_tavily(cls, raw: Dict[str, Any]) -> "SearchResult":
+        """Build a record from one item of Tavily's result list."""
+        snippet = str(raw.get("content") or raw.get("snippet") or "").strip()
+        return cls(
+            url=str(raw.get("url", "")),
+            title=str(raw.get("title") or "").strip(),
+            snippet=snippet[:SNIPPET_LIMIT],
+            score=round(float(raw.get("score") or 0.0), 4),
+            published=str(raw.get("published_date") or raw.get("published") or ""),
+            content_hash=content_hash(snippet) if snippet else "",
+        )
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Lean serialization for the report archive: empty/default fields are omitted."""
+        data: Dict[str, Any] = {"url": self.url}
+        if self.title:
+            data["title"] = self.title
+        if self.snippet:
+            data["snippet"] = self.snippet
+        if self.score:
+            data["score"] = self.score
+        if self.published:
+            data["published"] = self.published
+        if self.content_hash:
+            data["content_hash"] = self.content_hash
+        if self.content:
+            data["content"] = self.content
+        return data
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "SearchResult":
+        return cls(**{k: v for k, v in data.items() if k in cls.__dataclass_fields__})
+
+    def to_prompt(self, include_content: bool = False) -> str:
+        """Compact text form used in tool messages and the writer prompt."""
+        header = f"[{self.title or self.url}]({self.url})"
+        if self.published:
+            header += f" ({self.published})"
+        body = self.content[:PROMPT_CONTENT_LIMIT] if include_content and self.content else self.snippet
+        return f"- {header}\n  {body}" if body else f"- {header}"
+
+@dataclass(slots=True)
+class SearchFinding:
+    """The outcome of one planned search: the summary plus the sources behind it."""
+    query: str
+    reason: str = ""
+    summary: str = ""
+    sources: List[SearchResult] = field(default_factory=list)
+    error: str = ""
+
+def dedupe_results(results: Iterable[SearchResult]) -> List[SearchResult]:
+    """Drop repeated sources (same URL or same content), keeping the first occurrence."""
+    seen_urls, seen_hashes = set(), set()
+    unique: List[SearchResult] = []
+    for result in results:
+        if result.url in seen_urls or (result.content_hash and result.content_hash in seen_hashes):
+            continue
+        seen_urls.add(result.url)
+        if result.content_hash:
+            seen_hashes.add(result.content_hash)
+        unique.append(result)
+    return unique
+
+def format_results(results: Iterable[SearchResult], include_content: bool = False) -> str:
+    """Render search results compactly for an LLM prompt."""
+    lines = [r.to_prompt(include_content) for r in results]
+    return "\n".join(lines) if lines else "No results found."
+
 class ResearchState(TypedDict, total=False):
     messages: Annotated[List[BaseMessage], add_messages]
+    job_id: str
+    deadline: float  # epoch seconds, see deadline.py
     query: str
     search_plan: List[WebSearchItem]
-    search_results: List[str]
-    report: ReportData
\ No newline at end of file
+    # Bulky fields hold a side-store reference in lean state mode (see side_store.resolve)
+    search_results: Union[List[SearchFinding], BlobRef]
+    report: Union[ReportData, BlobRef]
+    partial_report: bool  # set when the report was assembled at the deadline or budget limit
+    degraded_report: bool  # short, trimmed, unparsed or written without any sources
@@ -0,0 +1,112 @@
+"""
+Tenant spend caching and ledger failure tests for the token budget.
+
+    python -m unittest discover tests
+"""
+import os
+import sys
+import time
+import asyncio
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import budget
+from budget import BudgetLedger, TenantLedger, charged
+
+class CountingLedger(TenantLedger):
+    """Tenant ledger that counts reads and can be switched off like an unreachable Redis."""
+
+    def __init__(self):
+        super().__init__()
+        self.reads = 0
+        self.down = False
+        self.hung = threading.Event()
+
+    def spent(self, tenant):
+        self.reads += 1
+        if self.hung.is_set():
+            time.sleep(1.0)
+        if self.down:
+            raise ConnectionError("ledger down")
+        return super().spent(tenant)
+
+    def record(self, tenant, cost):
+        if self.hung.is_set():
+            time.sleep(1.0)
+        if self.down:
+            raise ConnectionError("ledger down")
+        super().record(tenant, cost)
+
+class FakeModel:
+    async def ainvoke(self, messages):
+        return "ok"
+
+class BudgetLedgerTest(unittest.TestCase):
+    def setUp(self):
+        self.tenants = CountingLedger()
+        self.ledger = BudgetLedger(self.tenants)
+        self.ledger.open_job("job", tenant="t", limit=10000)
+        self._saved = budget._ledger
+        budget._ledger = self.ledger
+
+    def tearDown(self):
+        budget._ledger = self._saved
+
+    def charge(self, calls=1):
+        async def run():
+            for _ in range(calls):
+                await charged(FakeModel(), ["hello"], {"job_id": "job"}, output_tokens=10)
+        asyncio.run(run())
+
+    def test_budget_checks_use_cached_tenant_spend(self):
+        self.ledger.refresh_tenant("t")
+        reads = self.tenants.reads
+        self.charge(calls=5)
+        self.ledger.left("job")
+        self.assertEqual(self.tenants.reads, reads)
+        self.assertGreater(self.tenants.spent("t"), 0)
+
+    def test_unreachable_ledger_falls_back_to_local_tracking(self):
+        self.ledger.refresh_tenant("t")
+        self.tenants.down = True
+        before = self.ledger.tenant_left("t")
+
+        self.charge(calls=2)
+        self.ledger.refresh_tenant("t")
+
+        self.assertLess(self.ledger.tenant_left("t"), before)
+        self.assertGreater(self.ledger.unsynced.spent("t"), 0)
+
+    def test_hung_ledger_does_not_stall_model_calls(self):
+        self.ledger.refresh_tenant("t")
+        self.tenants.hung.set()
+        saved = budget.LEDGER_TIMEOUT, budget.TENANT_SPEND_REFRESH_SECONDS
+        budget.LEDGER_TIMEOUT, budget.TENANT_SPEND_REFRESH_SECONDS = 0.05, 0.0
+        try:
+            async def timed():
+                started = time.monotonic()
+                for _ in range(2):
+                    await charged(FakeModel(), ["hello"], {"job_id": "job"}, output_tokens=10)
+                return time.monotonic() - started
+            # asyncio.run itself still waits for the stuck ledger threads on exit
+            elapsed = asyncio.run(timed())
+        finally:
+            budget.LEDGER_TIMEOUT, budget.TENANT_SPEND_REFRESH_SECONDS = saved
+        self.assertLess(elapsed, 0.5)
+        # The spend is counted locally even though the ledger never answered in time
+        self.assertLess(self.ledger.tenant_left("t"), budget.TENANT_DAILY_TOKEN_BUDGET)
+
+    def test_stale_cache_is_refreshed(self):
+        self.ledger.refresh_tenant("t")
+        self.tenants.record("t", 500.0)  # spent by another process
+        saved, budget.TENANT_SPEND_REFRESH_SECONDS = budget.TENANT_SPEND_REFRESH_SECONDS, 0.0
+        try:
+            self.charge()
+        finally:
+            budget.TENANT_SPEND_REFRESH_SECONDS = saved
+        self.assertLessEqual(self.ledger.tenant_left("t"), budget.TENANT_DAILY_TOKEN_BUDGET - 500.0)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,112 @@
+"""
+Ranking, local-answer thresholds and embedding file growth for the document store.
+
+    python -m unittest discover tests
+"""
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import document_store
+from state import SearchResult
+from document_store import DocumentStore, embed_texts, tokenize
+
+def source(n, text, content=""):
+    return SearchResult(url=f"https://example.com/{n}", title=f"Source {n}", snippet=text, content=content)
+
+class DocumentStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.stores = []
+
+    def tearDown(self):
+        for store in self.stores:
+            store.close()
+        self.dir.cleanup()
+
+    def open_store(self):
+        store = DocumentStore(self.dir.name)
+        self.stores.append(store)
+        return store
+
+    def age(self, store, url, days):
+        store._db.execute("UPDATE docs SET fetched_at = fetched_at - ? WHERE url = ?", (days * 86400, url))
+        store._db.commit()
+
+    def test_bm25_prefers_rare_and_repeated_terms(self):
+        store = self.open_store()
+        store.add([
+            source(1, "solar panels solar panels efficiency"),
+            source(2, "solar panels pricing"),
+            source(3, "wind turbines pricing"),
+        ])
+        scores = store._bm25(tokenize("solar efficiency"))
+        self.assertNotIn(3, scores)
+        self.assertGreater(scores[1], scores[2])
+        # "efficiency" is in one document, "pricing" in two
+        self.assertGreater(store._bm25(["efficiency"])[1], store._bm25(["pricing"])[2])
+
+    def test_cosine_ranks_closest_embedding_first(self):
+        vectors = embed_texts(["battery storage costs", "battery storage costs", ""])
+        np.testing.assert_allclose(np.linalg.norm(vectors[:2], axis=1), 1.0, rtol=1e-5)
+        self.assertAlmostEqual(float(vectors[0] @ vectors[1]), 1.0, places=5)
+        self.assertFalse(vectors[2].any())
+
+        store = self.open_store()
+        store.add([source(1, "grid battery storage costs"), source(2, "coral reef bleaching")])
+        semantic = store._cosine("battery storage costs", rows=2, k=2)
+        self.assertEqual(max(semantic, key=semantic.get), 1)
+        self.assertLess(semantic[2], document_store.MIN_SIMILARITY)
+        self.assertEqual(store.search("volcanic eruptions iceland"), [])
+
+    def test_search_returns_deep_fetched_text(self):
+        store = self.open_store()
+        store.add([source(1, "heat pumps", content="Heat pumps move heat with a refrigerant cycle.")])
+        # A later plain search result for the same page keeps the page text
+        self.assertEqual(store.add([source(1, "heat pumps")]), 0)
+        [hit] = store.search("refrigerant cycle")
+        self.assertIn("refrigerant", hit.result.content)
+
+    def test_answer_locally_needs_enough_fresh_covering_hits(self):
+        store = self.open_store()
+        query = "lithium battery recycling"
+        store.add([source(n, f"lithium battery recycling report {n}") for n in range(1, 4)])
+        answered = store.answer_locally(query)
+        self.assertEqual(len(answered), document_store.LOCAL_MIN_HITS)
+
+        # Too few hits cover enough of the query
+        self.assertIsNone(store.answer_locally("lithium battery recycling subsidies europe"))
+
+        # Too old
+        self.age(store, "https://example.com/1", document_store.LOCAL_MAX_AGE_DAYS + 1)
+        self.assertIsNone(store.answer_locally(query))
+
+    def test_embeddings_grow_and_other_processes_remap(self):
+        with mock.patch.object(document_store, "INITIAL_CAPACITY", 4):
+            first = self.open_store()
+            second = self.open_store()
+            first.add([source(n, f"topic{n} overview") for n in range(1, 11)])
+            self.assertEqual(first._embeddings.shape[0], 16)
+            self.assertEqual(second._embeddings.shape[0], 4)
+
+            # The second handle still maps the old, smaller file until it next reads or writes
+            [hit] = second.search("topic9 overview", k=1)
+            self.assertEqual(hit.result.url, "https://example.com/9")
+            self.assertEqual(second._embeddings.shape[0], 16)
+
+            second.add([source(n, f"topic{n} overview") for n in range(11, 20)])
+            self.assertEqual(second._embeddings.shape[0], 32)
+            for n in (3, 17):
+                [hit] = first.search(f"topic{n} overview", k=1)
+                self.assertEqual(hit.result.url, f"https://example.com/{n}")
+            # Rows written before the growth survived the copy
+            np.testing.assert_allclose(first._embeddings[2], embed_texts(["Source 3\ntopic3 overview"])[0], rtol=1e-5)
+
+if __name__ == "__main__":
+    unittest.main()
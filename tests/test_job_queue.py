@@ -0,0 +1,248 @@
+"""
+Lease, redelivery and cancellation tests for the job queue and worker, run on InMemoryJobQueue.
+
+    python -m unittest discover tests
+"""
+import os
+import sys
+import time
+import asyncio
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from job_queue import (InMemoryJobQueue, QueuedResearchManager, CHUNK, RESTART, DONE, ERROR,
+                       MAX_ATTEMPTS, ABANDONED_MESSAGE, CANCELLED_MESSAGE, RESTART_BANNER)
+import worker as worker_module
+from worker import ResearchWorker
+from state import ReportData, ReportReady
+
+class FakeManager:
+    """Stands in for ResearchManager: yields a few chunks, slowly."""
+
+    def __init__(self, chunks=3, delay=0.01, report=None):
+        self.chunks = chunks
+        self.delay = delay
+        self.report = report
+        self.closed = 0
+
+    async def run(self, query, **options):
+        try:
+            for i in range(self.chunks):
+                await asyncio.sleep(self.delay)
+                yield f"{query}:{i}"
+            if self.report is not None:
+                yield ReportReady(query, self.report, "archived-id")
+        finally:
+            self.closed += 1
+
+def event_types(queue, job_id):
+    return [e.type for e in queue.read_events(job_id, timeout=0)]
+
+async def run_worker_until(worker, condition, timeout=5.0):
+    runner = asyncio.create_task(worker.run())
+    deadline = time.monotonic() + timeout
+    try:
+        while not condition() and time.monotonic() < deadline:
+            await asyncio.sleep(0.01)
+    finally:
+        worker.stop()
+        await asyncio.wait_for(runner, timeout)
+
+class InMemoryQueueTest(unittest.TestCase):
+    def test_expired_lease_is_redelivered_after_restart_event(self):
+        queue = InMemoryJobQueue(lease_seconds=0.01)
+        job_id = queue.enqueue("q")
+        first = queue.lease("w1")
+        time.sleep(0.02)
+
+        self.assertEqual(queue.requeue_expired(), 1)
+        second = queue.lease("w2")
+        self.assertEqual((second.job_id, second.attempts), (job_id, 2))
+        self.assertEqual(event_types(queue, job_id), [RESTART])
+        self.assertEqual(first.attempts, 1)
+
+    def test_job_fails_after_max_attempts(self):
+        queue = InMemoryJobQueue(lease_seconds=0.01)
+        job_id = queue.enqueue("q")
+        for _ in range(MAX_ATTEMPTS):
+            self.assertIsNotNone(queue.lease("w"))
+            time.sleep(0.02)
+            queue.requeue_expired()
+
+        self.assertIsNone(queue.lease("w"))
+        events = queue.read_events(job_id, timeout=0)
+        self.assertEqual([e.type for e in events], [RESTART] * (MAX_ATTEMPTS - 1) + [ERROR])
+        self.assertEqual(events[-1].data, ABANDONED_MESSAGE)
+
+    def test_stale_worker_cannot_publish_after_redelivery(self):
+        queue = InMemoryJobQueue(lease_seconds=0.01)
+        job_id = queue.enqueue("q")
+        queue.lease("w1")
+        time.sleep(0.02)
+        queue.requeue_expired()
+        queue.lease("w2")
+
+        self.assertFalse(queue.publish_output(job_id, "w1", "stale"))
+        self.assertTrue(queue.publish_output(job_id, "w2", "fresh"))
+        chunks = [e.data for e in queue.read_events(job_id, timeout=0) if e.type == CHUNK]
+        self.assertEqual(chunks, ["fresh"])
+
+    def test_cancelled_pending_job_is_never_leased(self):
+        queue = InMemoryJobQueue()
+        job_id = queue.enqueue("q")
+        queue.cancel(job_id)
+
+        self.assertIsNone(queue.lease("w"))
+        events = queue.read_events(job_id, timeout=0)
+        self.assertEqual([(e.type, e.data) for e in events], [(ERROR, CANCELLED_MESSAGE)])
+
+    def test_profile_request_is_taken_once(self):
+        queue = InMemoryJobQueue()
+        job_id = queue.enqueue("q")
+
+        self.assertFalse(queue.take_profile_request(job_id))
+        self.assertTrue(queue.request_profile(job_id))
+        self.assertTrue(queue.take_profile_request(job_id))
+        self.assertFalse(queue.take_profile_request(job_id))
+        self.assertFalse(queue.request_profile("no-such-job"))
+
+    def test_cancelled_running_job_loses_its_lease(self):
+        queue = InMemoryJobQueue()
+        job_id = queue.enqueue("q")
+        queue.lease("w")
+        queue.cancel(job_id)
+
+        self.assertFalse(queue.publish_output(job_id, "w", "late"))
+        self.assertFalse(queue.heartbeat(job_id, "w"))
+
+class WorkerTest(unittest.TestCase):
+    def test_worker_runs_job_to_done(self):
+        queue = InMemoryJobQueue()
+        job_id = queue.enqueue("q")
+        worker = ResearchWorker(queue, manager=FakeManager())
+
+        asyncio.run(run_worker_until(worker, lambda: DONE in event_types(queue, job_id)))
+        self.assertEqual(event_types(queue, job_id), [CHUNK, CHUNK, CHUNK, DONE])
+
+    def test_finished_report_reaches_the_client_intact(self):
+        queue = InMemoryJobQueue()
+        report = ReportData(short_summary="s", markdown_report="# r", follow_up_questions=["f"])
+        worker = ResearchWorker(queue, manager=FakeManager(chunks=1, report=report))
+
+        async def consume():
+            output = []
+            async def collect():
+                async for chunk in QueuedResearchManager(queue).run("q"):
+                    output.append(chunk)
+            client = asyncio.create_task(collect())
+            await run_worker_until(worker, client.done)
+            await client
+            return output
+
+        output = asyncio.run(consume())
+        ready = output[-1]
+        self.assertIsInstance(ready, ReportReady)
+        self.assertEqual((ready.query, ready.report, ready.report_id), ("q", report, "archived-id"))
+        self.assertEqual("".join(output[1:]), "q:0")
+
+    def test_worker_profiles_job_on_request(self):
+        queue = InMemoryJobQueue()
+        job_id = queue.enqueue("q")
+        queue.request_profile(job_id)
+        worker = ResearchWorker(queue, manager=FakeManager(chunks=20, delay=0.01), heartbeat_interval=0.02)
+        requested = []
+        saved, worker_module.request_profile = worker_module.request_profile, requested.append
+        try:
+            asyncio.run(run_worker_until(worker, lambda: DONE in event_types(queue, job_id)))
+        finally:
+            worker_module.request_profile = saved
+        self.assertEqual(requested, [job_id])
+
+    def test_worker_stops_at_next_chunk_after_cancel(self):
+        queue = InMemoryJobQueue()
+        job_id = queue.enqueue("q")
+        manager = FakeManager(chunks=100, delay=0.01)
+        # Heartbeats never come round, so only the refused chunk can stop the job
+        worker = ResearchWorker(queue, manager=manager, heartbeat_interval=60.0)
+
+        def cancel_after_first_chunk():
+            if CHUNK in event_types(queue, job_id) and job_id not in queue._cancelled:
+                queue.cancel(job_id)
+            return manager.closed
+
+        asyncio.run(run_worker_until(worker, cancel_after_first_chunk))
+        types = event_types(queue, job_id)
+        self.assertEqual(manager.closed, 1)
+        self.assertLess(types.count(CHUNK), 5)
+        self.assertEqual(types[-1], ERROR)
+
+    def test_cancel_failure_does_not_escape_the_client(self):
+        class BrokenCancelQueue(InMemoryJobQueue):
+            def cancel(self, job_id):
+                raise ConnectionError("queue down")
+
+        async def abandon():
+            stream = QueuedResearchManager(BrokenCancelQueue()).run("q")
+            await stream.__anext__()
+            await stream.aclose()
+
+        asyncio.run(abandon())
+
+    def test_worker_abandons_job_when_heartbeats_keep_failing(self):
+        class FlakyQueue(InMemoryJobQueue):
+            def heartbeat(self, job_id, worker_id):
+                raise ConnectionError("queue down")
+
+        queue = FlakyQueue(lease_seconds=0.2)
+        job_id = queue.enqueue("q")
+        manager = FakeManager(chunks=100, delay=0.01)
+        worker = ResearchWorker(queue, manager=manager, heartbeat_interval=0.05)
+
+        asyncio.run(run_worker_until(worker, lambda: manager.closed, timeout=5.0))
+        types = event_types(queue, job_id)
+        self.assertEqual(manager.closed, 1)
+        self.assertNotIn(DONE, types)
+        self.assertLess(types.count(CHUNK), 100)
+
+    def test_worker_survives_queue_errors(self):
+        class OutageQueue(InMemoryJobQueue):
+            failures = 2
+
+            def lease(self, worker_id):
+                if self.failures:
+                    self.failures -= 1
+                    raise ConnectionError("queue down")
+                return super().lease(worker_id)
+
+        queue = OutageQueue()
+        job_id = queue.enqueue("q")
+        worker = ResearchWorker(queue, manager=FakeManager())
+
+        asyncio.run(run_worker_until(worker, lambda: DONE in event_types(queue, job_id), timeout=10.0))
+        self.assertEqual(event_types(queue, job_id)[-1], DONE)
+
+class QueuedResearchManagerTest(unittest.TestCase):
+    def test_restart_is_reported_with_the_reset_banner(self):
+        queue = InMemoryJobQueue(lease_seconds=0.01)
+        manager = QueuedResearchManager(queue)
+
+        async def consume():
+            output = []
+            stream = manager.run("q")
+            output.append(await stream.__anext__())  # queued banner, job now enqueued
+            queue.lease("w1")
+            time.sleep(0.02)
+            queue.requeue_expired()
+            job = queue.lease("w2")
+            queue.publish_output(job.job_id, "w2", "report")
+            queue.complete(job.job_id, "w2")
+            async for chunk in stream:
+                output.append(chunk)
+            return output
+
+        output = asyncio.run(consume())
+        self.assertEqual(output[1:], [RESTART_BANNER, "report"])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,91 @@
+"""
+Address checks, redirect handling and cache pruning for the deep-fetch stage.
+
+    python -m unittest discover tests
+"""
+import os
+import sys
+import time
+import asyncio
+import tempfile
+import unittest
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from state import content_hash
+from page_fetcher import PageFetcher, PageCache, BlockedURL, check_public_url, MAX_REDIRECTS
+
+PUBLIC = "http://93.184.216.34"
+ARTICLE = "<html><body><p>" + "This paragraph is long enough to count as article text. " * 3 + "</p></body></html>"
+
+def redirect_to(target):
+    return httpx.Response(302, headers={"Location": target})
+
+class PageFetcherTest(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.TemporaryDirectory()
+        self.requested = []
+
+    def tearDown(self):
+        self.cache_dir.cleanup()
+
+    def fetch(self, url, handler):
+        def record(request):
+            self.requested.append(str(request.url))
+            return handler(request)
+
+        async def run():
+            async with PageFetcher(cache=PageCache(self.cache_dir.name)) as fetcher:
+                await fetcher._client.aclose()
+                fetcher._client = httpx.AsyncClient(transport=httpx.MockTransport(record))
+                return await fetcher.fetch_text(url)
+        return asyncio.run(run())
+
+    def test_non_public_addresses_are_refused(self):
+        for url in ("http://127.0.0.1/", "http://10.0.0.5/", "http://169.254.169.254/latest/meta-data/",
+                    "http://[::1]/", "http://[::ffff:127.0.0.1]/", "file:///etc/passwd", "http://localhost:8080/"):
+            with self.subTest(url=url), self.assertRaises(BlockedURL):
+                asyncio.run(check_public_url(url))
+        asyncio.run(check_public_url(PUBLIC + "/page"))
+
+    def test_redirect_to_private_address_is_not_followed(self):
+        text = self.fetch(PUBLIC + "/", lambda request: redirect_to("http://169.254.169.254/latest/meta-data/"))
+        self.assertEqual(text, "")
+        self.assertEqual(self.requested, [PUBLIC + "/"])
+
+    def test_public_redirects_are_followed(self):
+        def handler(request):
+            if request.url.path == "/old":
+                return redirect_to(PUBLIC + "/new")
+            return httpx.Response(200, headers={"Content-Type": "text/html"}, text=ARTICLE)
+
+        text = self.fetch(PUBLIC + "/old", handler)
+        self.assertIn("article text", text)
+        self.assertEqual(self.requested, [PUBLIC + "/old", PUBLIC + "/new"])
+
+    def test_redirect_loops_stop(self):
+        self.assertEqual(self.fetch(PUBLIC + "/", lambda request: redirect_to(PUBLIC + "/")), "")
+        self.assertEqual(len(self.requested), MAX_REDIRECTS + 1)
+
+class PageCacheTest(unittest.TestCase):
+    def test_prune_evicts_least_recently_used_texts(self):
+        with tempfile.TemporaryDirectory() as directory:
+            # Room for two of the three ~1 KB texts
+            cache = PageCache(directory, max_mb=2500 / (1024 * 1024))
+            pages = {f"https://example.com/{i}": f"page {i} " + "x" * 1000 for i in range(3)}
+            for i, (url, text) in enumerate(pages.items()):
+                cache.put(url, text)
+                stored_at = time.time() - 60 + i
+                os.utime(os.path.join(cache.text_dir, f"{content_hash(text)}.txt"), (stored_at, stored_at))
+            # Reading the oldest page makes it the most recently used
+            self.assertIsNotNone(cache.get("https://example.com/0"))
+
+            cache.prune()
+            self.assertIsNotNone(cache.get("https://example.com/0"))
+            self.assertIsNone(cache.get("https://example.com/1"))
+            self.assertIsNotNone(cache.get("https://example.com/2"))
+
+if __name__ == "__main__":
+    unittest.main()
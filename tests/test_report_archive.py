@@ -0,0 +1,122 @@
+"""
+Report reuse, search and listing pages for the report archive, and which reports get archived.
+
+    python -m unittest discover tests
+"""
+import os
+import sys
+import time
+import asyncio
+import tempfile
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import report_archive
+from report_archive import ReportArchive
+from research_manager import ResearchManager
+from state import ReportData, ReportReady, SearchFinding, SearchResult
+
+def report(summary, body="# Report"):
+    return ReportData(short_summary=summary, markdown_report=body, follow_up_questions=["What next?"])
+
+class FinishedGraph:
+    """Stands in for the compiled graph: runs no nodes and ends in the given state."""
+
+    def __init__(self, values):
+        self.values = values
+
+    async def astream(self, inputs, config=None, stream_mode=None):
+        return
+        yield
+
+    async def aget_state(self, config):
+        return SimpleNamespace(values=self.values)
+
+class ReportArchiveTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.archive = ReportArchive(self.dir.name)
+
+    def tearDown(self):
+        self.archive._db.close()
+        self.dir.cleanup()
+
+    def save_at(self, created_at, query, data):
+        with mock.patch.object(report_archive.time, "time", return_value=created_at):
+            return self.archive.save(query, data, [SearchResult(url="https://example.com/a", title="A")])
+
+    def test_find_fresh_matches_recent_reports_for_the_same_query(self):
+        report_id = self.archive.save("Solar panel efficiency in 2025", report("Panels improved."), [])
+        match = self.archive.find_fresh("solar panel efficiency 2025?")
+        self.assertEqual(match.report_id, report_id)
+        query, loaded, _ = self.archive.load(match.report_id)
+        self.assertEqual(loaded.short_summary, "Panels improved.")
+
+        self.assertIsNone(self.archive.find_fresh("solar panel prices"))
+        self.assertIsNone(self.archive.find_fresh("solar panel efficiency 2025", max_age_hours=0))
+
+    def test_old_reports_are_not_fresh(self):
+        self.save_at(time.time() - 3 * 3600, "wind farm output", report("Old."))
+        self.assertIsNone(self.archive.find_fresh("wind farm output", max_age_hours=2))
+        self.assertIsNotNone(self.archive.find_fresh("wind farm output", max_age_hours=4))
+
+    def test_search_pages_through_matches(self):
+        for n in range(5):
+            self.save_at(1000.0 + n, f"energy question {n}", report(f"Summary {n}", f"Hydrogen storage, part {n}."))
+        self.save_at(2000.0, "unrelated", report("Nothing here", "Coral reefs."))
+
+        pages = [self.archive.search("hydrogen", limit=2, offset=offset) for offset in (0, 2, 4, 6)]
+        self.assertEqual([len(page) for page in pages], [2, 2, 1, 0])
+        found = {entry.query for page in pages for entry in page}
+        self.assertEqual(found, {f"energy question {n}" for n in range(5)})
+        # User input is never parsed as FTS syntax
+        self.assertEqual(self.archive.search('hydrogen" OR body:*'), self.archive.search("hydrogen body"))
+
+    def test_listing_pages_newest_first_by_cursor(self):
+        for n in range(5):
+            self.save_at(1000.0 + n, f"question {n}", report(f"Summary {n}"))
+
+        queries, before = [], None
+        while True:
+            page = self.archive.list_reports(before=before, limit=2)
+            if not page:
+                break
+            queries += [entry.query for entry in page]
+            before = page[-1].created_at
+        self.assertEqual(queries, [f"question {n}" for n in reversed(range(5))])
+
+class ArchivingTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.manager = ResearchManager()
+        self.manager.archive = ReportArchive(self.dir.name)
+
+    def tearDown(self):
+        self.manager.archive._db.close()
+        self.dir.cleanup()
+
+    def finish(self, **flags):
+        finding = SearchFinding(query="q", summary="s", sources=[SearchResult(url="https://example.com/a", title="A")])
+        self.manager.graph = FinishedGraph({"report": report("Done."), "search_results": [finding], **flags})
+
+        async def run():
+            return [chunk async for chunk in self.manager.run("grid batteries", reuse_archive=False)]
+        return [chunk for chunk in asyncio.run(run()) if isinstance(chunk, ReportReady)][0]
+
+    def test_complete_reports_are_archived(self):
+        ready = self.finish()
+        self.assertTrue(ready.report_id)
+        self.assertEqual(self.manager.archive.count(), 1)
+
+    def test_partial_and_degraded_reports_are_not_archived(self):
+        for flag in ("partial_report", "degraded_report"):
+            with self.subTest(flag=flag):
+                ready = self.finish(**{flag: True})
+                self.assertEqual(ready.report_id, "")
+        self.assertEqual(self.manager.archive.count(), 0)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,201 @@
+"""
+Research worker: leases jobs from the shared queue and runs the research graph.
+
+Start one process per CPU on every machine that should take work:
+
+    RESEARCH_QUEUE_URL=redis://queue-host:6379/0 python worker.py --processes 4
+
+Front ends pointed at the same RESEARCH_QUEUE_URL only enqueue jobs and stream
+their events (see job_queue.QueuedResearchManager). With RESEARCH_DIAGNOSTICS=1,
+`kill -USR1 <pid>` profiles the jobs a worker process is running, and
+
+    python worker.py --profile-job <job id>
+
+profiles one job, on whichever worker runs it (see diagnostics).
+"""
+import os
+import time
+import socket
+import asyncio
+import argparse
+import contextlib
+import logging
+import multiprocessing
+from typing import Optional
+
+from job_queue import JobQueue, Job, create_job_queue, CHUNK, REPORT, HEARTBEAT_INTERVAL, LEASE_SECONDS, QUEUE_URL
+from state import ReportReady
+from diagnostics import install_profile_signal, request_profile
+
+logger = logging.getLogger(__name__)
+
+IDLE_POLL_INTERVAL = 1.0
+# Retry delay after a failed heartbeat, and the longest backoff after queue errors
+HEARTBEAT_RETRY_INTERVAL = 2.0
+MAX_ERROR_BACKOFF = 30.0
+
+class LeaseLost(Exception):
+    """This worker no longer owns the job it is running."""
+
+class ResearchWorker:
+    """Runs up to `concurrency` leased jobs at a time on one event loop."""
+
+    def __init__(self, queue: JobQueue, concurrency: int = 2, manager=None, heartbeat_interval: float = HEARTBEAT_INTERVAL):
+        self.queue = queue
+        self.concurrency = concurrency
+        self.heartbeat_interval = heartbeat_interval
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{id(self):x}"
+        self._manager = manager
+        self._running: set = set()
+        self._stopping = False
+
+    @property
+    def manager(self):
+        # Imported lazily so the graph and model clients are built inside the worker process
+        if self._manager is None:
+            from research_manager import ResearchManager
+            self._manager = ResearchManager()
+        return self._manager
+
+    async def _keep_lease(self, job: Job, task: asyncio.Task, lease_lost: asyncio.Event) -> None:
+        """Heartbeat until the job ends; cancel it if the lease is lost or cannot be confirmed in time."""
+        lease_seconds = getattr(self.queue, "lease_seconds", LEASE_SECONDS)
+        confirmed_at = time.monotonic()
+        delay = self.heartbeat_interval
+        while not task.done():
+            await asyncio.sleep(delay)
+            try:
+                owned = await asyncio.to_thread(self.queue.heartbeat, job.job_id, self.worker_id)
+            except Exception as e:
+                # Keep trying while the lease may still be ours; past that, another worker may have the job
+                if time.monotonic() - confirmed_at + HEARTBEAT_RETRY_INTERVAL < lease_seconds:
+                    logger.warning(f"Heartbeat for job {job.job_id} failed, retrying: {e}")
+                    delay = HEARTBEAT_RETRY_INTERVAL
+                    continue
+                logger.warning(f"Could not confirm lease on job {job.job_id} before it expires, cancelling")
+                owned = False
+            if not owned:
+                logger.warning(f"Lost lease on job {job.job_id}, cancelling")
+                lease_lost.set()
+                task.cancel()
+                return
+            confirmed_at = time.monotonic()
+            delay = self.heartbeat_interval
+            try:
+                if await asyncio.to_thread(self.queue.take_profile_request, job.job_id):
+                    print(f"🔥 Profiling job {job.job_id} on request")
+                    request_profile(job.job_id)
+            except Exception as e:
+                logger.warning(f"Could not check profile requests for job {job.job_id}: {e}")
+
+    async def _execute(self, job: Job) -> None:
+        # aclosing: stopping early must close the run so its model calls are cancelled
+        # The queue's job ID names the run, so profile requests and logs line up with it
+        options = dict(job.options, job_id=job.job_id)
+        async with contextlib.aclosing(self.manager.run(job.query, **options)) as chunks:
+            async for chunk in chunks:
+                # The finished report travels as JSON so front ends can export exactly what they showed
+                data, type = (chunk.to_json(), REPORT) if isinstance(chunk, ReportReady) else (chunk, CHUNK)
+                # Refused when the lease has moved on, so a stale attempt never interleaves with the new one
+                if not await asyncio.to_thread(self.queue.publish_output, job.job_id, self.worker_id, data, type):
+                    raise LeaseLost(job.job_id)
+
+    async def _run_job(self, job: Job) -> None:
+        print(f"🛠️ Worker {self.worker_id} running job {job.job_id} (attempt {job.attempts})")
+        task = asyncio.create_task(self._execute(job))
+        lease_lost = asyncio.Event()
+        keeper = asyncio.create_task(self._keep_lease(job, task, lease_lost))
+        error = ""
+        try:
+            await task
+        except asyncio.CancelledError:
+            if not lease_lost.is_set():
+                raise
+            # Lease lost: the job now belongs to someone else, so publish nothing
+            return
+        except LeaseLost:
+            logger.warning(f"Lost lease on job {job.job_id} while publishing, abandoning it")
+            return
+        except Exception as e:
+            logger.exception(f"Job {job.job_id} failed")
+            error = str(e)
+        finally:
+            keeper.cancel()
+        try:
+            await asyncio.to_thread(self.queue.complete, job.job_id, self.worker_id, error)
+        except Exception as e:
+            # The lease will expire and the job is redelivered
+            logger.error(f"Could not complete job {job.job_id}: {e}")
+            return
+        print(f"✅ Worker {self.worker_id} finished job {job.job_id}")
+
+    async def run(self) -> None:
+        """Lease and run jobs until stop() is called."""
+        print(f"🚀 Worker {self.worker_id} started (concurrency {self.concurrency})")
+        install_profile_signal()
+        backoff = IDLE_POLL_INTERVAL
+        while not self._stopping:
+            job: Optional[Job] = None
+            try:
+                await asyncio.to_thread(self.queue.requeue_expired)
+                if len(self._running) < self.concurrency:
+                    job = await asyncio.to_thread(self.queue.lease, self.worker_id)
+            except Exception as e:
+                # e.g. a brief Redis outage: back off and keep the worker alive
+                logger.error(f"Queue unavailable, retrying in {backoff:.0f}s: {e}")
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, MAX_ERROR_BACKOFF)
+                continue
+            backoff = IDLE_POLL_INTERVAL
+            if job is None:
+                await asyncio.sleep(IDLE_POLL_INTERVAL)
+                continue
+            task = asyncio.create_task(self._run_job(job))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+        if self._running:
+            await asyncio.gather(*self._running, return_exceptions=True)
+
+    def stop(self) -> None:
+        self._stopping = True
+
+def _worker_process(queue_url: str, concurrency: int) -> None:
+    logging.basicConfig(level=logging.INFO)
+    worker = ResearchWorker(create_job_queue(queue_url), concurrency=concurrency)
+    try:
+        asyncio.run(worker.run())
+    except KeyboardInterrupt:
+        pass
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Run research workers against the shared job queue.")
+    parser.add_argument("--queue-url", default=QUEUE_URL, help="Queue URL (default: $RESEARCH_QUEUE_URL)")
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1, help="Worker processes to start")
+    parser.add_argument("--concurrency", type=int, default=2, help="Jobs run concurrently per process")
+    parser.add_argument("--profile-job", metavar="JOB_ID", help="Profile a queued or running job, then exit")
+    args = parser.parse_args()
+
+    if not args.queue_url or args.queue_url.startswith("memory://"):
+        parser.error("a shared queue is required, e.g. --queue-url redis://localhost:6379/0")
+
+    if args.profile_job:
+        if not create_job_queue(args.queue_url).request_profile(args.profile_job):
+            parser.error(f"job {args.profile_job} is unknown or already finished")
+        print(f"🔥 Job {args.profile_job} will be profiled by its worker (needs RESEARCH_DIAGNOSTICS=1 there)")
+        return
+
+    processes = [
+        multiprocessing.Process(target=_worker_process, args=(args.queue_url, args.concurrency), daemon=False)
+        for _ in range(args.processes)
+    ]
+    for process in processes:
+        process.start()
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.terminate()
+
+if __name__ == "__main__":
+    main()
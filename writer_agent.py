@@ -1,6 +1,11 @@
 from langchain_core.messages import SystemMessage, HumanMessage, AIMessage
-from llm_models import model_large
-from state import ReportData, ResearchState
+from llm_models import model_mini, model_large
+from typing import List
+from state import ReportData, ResearchState, SearchFinding, dedupe_results, format_results
+from side_store import stash, resolve
+from deadline import time_left, DeadlineExceeded, SHORT_REPORT_SECONDS
+from budget import (charged, budget_left, estimate_tokens, trim_to_tokens, BudgetExceeded,
+                    MODEL_COST_WEIGHTS, NOTIFY_TOKEN_RESERVE)
 import json
 import re
 
@@ -43,26 +48,131 @@ IMPORTANT: Return a valid JSON object with these exact keys:
 
 Return ONLY the JSON object, no other text."""
 
-async def writer_node(state: ResearchState) -> dict:
-    """WriterAgent: Synthesize the final report."""
-    print("Thinking about the report...🤔")
-    
-    # Create prompt
-    prompt = f"""ORIGINAL QUERY: {state['query']}
+# Used when the job is close to its deadline or its token budget
+SHORT_WRITER_INSTRUCTIONS = WRITER_INSTRUCTIONS.replace("1500-2000 words", "500-800 words").replace(
+    "COMPREHENSIVE", "FOCUSED"
+)
+
+WRITER_MODELS = {"large": model_large, "mini": model_mini}
+# Output allowances for a full (1500-2000 words) and a short (500-800 words) report
+FULL_REPORT_TOKENS = 3000
+SHORT_REPORT_TOKENS = 1200
+# Smallest slice of research results worth writing a report from
+MIN_FINDINGS_TOKENS = 500
+MESSAGE_OVERHEAD_TOKENS = 30
+
+def format_findings(findings: List[SearchFinding]) -> str:
+    """Render search findings for the writer prompt, listing each source only once."""
+    blocks = []
+    for finding in findings:
+        if finding.error:
+            blocks.append(f"SEARCH: {finding.query}\nERROR: {finding.error}")
+            continue
+        blocks.append(f"SEARCH: {finding.query}\nREASON: {finding.reason}\nSUMMARY: {finding.summary}")
+    sources = dedupe_results(s for finding in findings for s in finding.sources)
+    if sources:
+        blocks.append("SOURCES:\n" + format_results(sources))
+    return f"\n{'-'*60}\n".join(blocks)
+
+def fallback_report(query: str, findings: List[SearchFinding], reason: str = "the research deadline was reached") -> ReportData:
+    """Assemble a report straight from the search summaries when there is no time or budget left to write one."""
+    answered = [f for f in findings if not f.error]
+    sections = [f"### {f.query}\n\n{f.summary}" for f in answered]
+    missing = [f"- {f.query}" for f in findings if f.error]
+    markdown = f"# {query}\n\n*Partial report: {reason} before a full report could be written.*\n\n"
+    markdown += "## Findings\n\n" + ("\n\n".join(sections) if sections else "I could not find information on this topic in time.")
+    if missing:
+        markdown += "\n\n## Not Covered\n\n" + "\n".join(missing)
+    sources = dedupe_results(s for f in answered for s in f.sources)
+    if sources:
+        markdown += "\n\n## Sources\n\n" + "\n".join(f"- [{s.title or s.url}]({s.url})" for s in sources)
+    return ReportData(
+        short_summary=f"Partial research on {query}: {len(answered)} of {len(findings)} searches completed.",
+        markdown_report=markdown,
+        follow_up_questions=[f.query for f in findings if f.error] or [query],
+    )
+
+def writer_prompt(query: str, findings_text: str, instructions: str) -> str:
+    return f"""ORIGINAL QUERY: {query}
 
 RESEARCH RESULTS:
 {"="*50}
-{chr(10).join(state['search_results'])}
+{findings_text}
 {"="*50}
 
-{WRITER_INSTRUCTIONS}
+{instructions}
 
 Return ONLY the JSON object with no additional text."""
 
-    response = await model_large.ainvoke([
-        SystemMessage(content="You are a research writer. Return JSON only."),
-        HumanMessage(content=prompt)
-    ])
+def choose_writer(state: ResearchState, findings_text: str, short: bool):
+    """Pick the richest (model tier, instructions, output allowance, findings) the token budget allows.
+
+    Steps down from model_large to model_mini, then to a short report, then to
+    trimmed findings. Returns None when not even that fits.
+    """
+    tiers = [("large", SHORT_WRITER_INSTRUCTIONS if short else WRITER_INSTRUCTIONS),
+             ("mini", SHORT_WRITER_INSTRUCTIONS if short else WRITER_INSTRUCTIONS),
+             ("mini", SHORT_WRITER_INSTRUCTIONS)]
+    left = budget_left(state, keep=NOTIFY_TOKEN_RESERVE)
+    if left is None:
+        return tiers[0][0], tiers[0][1], FULL_REPORT_TOKENS, findings_text
+    
+    for tier, instructions in dict.fromkeys(tiers):
+        output = SHORT_REPORT_TOKENS if instructions is SHORT_WRITER_INSTRUCTIONS else FULL_REPORT_TOKENS
+        cost = (estimate_tokens(writer_prompt(state['query'], findings_text, instructions)) + output) * MODEL_COST_WEIGHTS[tier]
+        if cost <= left:
+            return tier, instructions, output, findings_text
+    
+    # Cut the research results down to what the cheapest short report can afford
+    overhead = estimate_tokens(writer_prompt(state['query'], "", SHORT_WRITER_INSTRUCTIONS)) + SHORT_REPORT_TOKENS
+    room = left / MODEL_COST_WEIGHTS["mini"] - overhead - MESSAGE_OVERHEAD_TOKENS
+    if room < MIN_FINDINGS_TOKENS:
+        return None
+    return "mini", SHORT_WRITER_INSTRUCTIONS, SHORT_REPORT_TOKENS, trim_to_tokens(findings_text, room)
+
+async def writer_node(state: ResearchState) -> dict:
+    """WriterAgent: Synthesize the final report."""
+    print("Thinking about the report...🤔")
+    findings = resolve(state.get('search_results', []))
+    
+    remaining = time_left(state)
+    short = remaining is not None and remaining < SHORT_REPORT_SECONDS
+    if short:
+        print(f"⏰ {max(remaining, 0):.0f}s left, writing a short report")
+    
+    findings_text = format_findings(findings)
+    choice = choose_writer(state, findings_text, short)
+    # Reports written on reduced means are served, but never archived for reuse
+    degraded = short or not any(not f.error for f in findings)
+    try:
+        if choice is None:
+            raise BudgetExceeded("Token budget exhausted before writing")
+        tier, instructions, output_tokens, prompt_findings = choice
+        if tier != "large" or (instructions is SHORT_WRITER_INSTRUCTIONS and not short) or prompt_findings != findings_text:
+            degraded = True
+            print(f"💰 Token budget low, writing {'a short' if instructions is SHORT_WRITER_INSTRUCTIONS else 'the'} report with model_{tier}")
+        
+        # Create prompt
+        prompt = writer_prompt(state['query'], prompt_findings, instructions)
+        
+        response = await charged(WRITER_MODELS[tier], [
+            SystemMessage(content="You are a research writer. Return JSON only."),
+            HumanMessage(content=prompt)
+        ], state, tier=tier, output_tokens=output_tokens, keep=NOTIFY_TOKEN_RESERVE)
+    except DeadlineExceeded:
+        print("⏰ Deadline reached while writing, returning partial report")
+        return {
+            "report": stash(state.get("job_id", ""), fallback_report(state['query'], findings)),
+            "partial_report": True,
+            "messages": [AIMessage(content="Partial report generated at deadline.")]
+        }
+    except BudgetExceeded:
+        print("💰 Token budget exhausted, returning partial report")
+        return {
+            "report": stash(state.get("job_id", ""), fallback_report(state['query'], findings, "the token budget ran out")),
+            "partial_report": True,
+            "messages": [AIMessage(content="Partial report generated at budget limit.")]
+        }
     
     content = response.content.strip()
     
@@ -83,12 +193,14 @@ Return ONLY the JSON object with no additional text."""
             try:
                 data = json.loads(match.group())
             except:
+                degraded = True
                 data = {
                     "short_summary": f"Research on {state['query']}",
                     "markdown_report": content,
                     "follow_up_questions": ["What are the key findings?", "What needs more research?"]
                 }
         else:
+            degraded = True
             data = {
                 "short_summary": "Report generation issue",
                 "markdown_report": content,
@@ -103,6 +215,7 @@ Return ONLY the JSON object with no additional text."""
     
     print("Finished writing report")
     return {
-        "report": report,
+        "report": stash(state.get("job_id", ""), report),
+        "degraded_report": degraded,
         "messages": [AIMessage(content="Final Report Generated.")]
     }
\ No newline at end of file